@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Benchmark of the installed apps inventory
+
+    Lists fake installed apps - 200 by default - with app_list and reads
+    them all with _get_apps_inventory, for increasing numbers of apps, and
+    shows that the time per app stays constant. The number of times the
+    apps catalog is loaded is also reported, which must be 1 per run.
+
+    Run on a YunoHost system - or with moulinette installed - with:
+        python benchmarks/bench_app_inventory.py [--apps 200] [--runs 5]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import __builtin__
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import moulinette
+from yunohost import app
+
+
+def make_apps(root, count):
+    """Write an apps list and count installed apps into root"""
+    repo_path = os.path.join(root, 'repo')
+    settings_path = os.path.join(root, 'apps') + '/'
+    os.makedirs(repo_path)
+    os.makedirs(settings_path)
+
+    applist = {}
+    for i in range(count):
+        app_id = 'app%04d' % i
+        manifest = {
+            'id': app_id,
+            'name': 'App %d' % i,
+            'description': {'en': 'Benchmark app %d' % i},
+            'license': 'free',
+            'version': '1.0',
+            'multi_instance': 'false',
+        }
+        applist[app_id] = {
+            'manifest': manifest,
+            'git': {'url': 'https://example.org/%s' % app_id,
+                    'revision': 'HEAD'},
+            'lastUpdate': 0,
+        }
+
+        path = settings_path + app_id
+        os.mkdir(path)
+        with open(path + '/manifest.json', 'w') as f:
+            json.dump(manifest, f)
+        with open(path + '/settings.yml', 'w') as f:
+            f.write('id: %s\nlabel: App %d\ninstall_time: 0\n' % (app_id, i))
+        with open(path + '/status.json', 'w') as f:
+            json.dump({'installed_at': 0, 'upgraded_at': 0,
+                       'remote': {'type': None}}, f)
+
+    with open(os.path.join(repo_path, 'bench.json'), 'w') as f:
+        json.dump(applist, f)
+    return repo_path, settings_path
+
+
+def run(root, count, runs):
+    app.repo_path, app.apps_setting_path = make_apps(root, count)
+    app.apps_catalog_cache = os.path.join(root, 'apps_catalog.json')
+
+    # Count the catalog loads
+    loads = [0]
+    get_apps_catalog = app._get_apps_catalog
+    def _counting_get_apps_catalog():
+        loads[0] += 1
+        return get_apps_catalog()
+    app._get_apps_catalog = _counting_get_apps_catalog
+
+    results = {}
+    try:
+        for name, func in [
+                ('app_list', lambda: app.app_list(installed=True)),
+                ('inventory', app._get_apps_inventory)]:
+            best = None
+            for i in range(runs):
+                # Start from a cold process state each time
+                app._apps_catalog = None
+                app._apps_settings_cache.clear()
+                if os.path.exists(app.apps_catalog_cache):
+                    os.remove(app.apps_catalog_cache)
+                loads[0] = 0
+                start = time.time()
+                func()
+                elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            results[name] = (best, loads[0])
+    finally:
+        app._get_apps_catalog = get_apps_catalog
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--apps', type=int, default=200,
+                        help="Maximum number of installed apps")
+    parser.add_argument('--runs', type=int, default=5,
+                        help="Number of runs to keep the best time of")
+    args = parser.parse_args()
+
+    if not hasattr(__builtin__, 'm18n'):
+        moulinette.init()
+        m18n.load_namespace('yunohost')
+
+    counts = sorted(set([max(1, args.apps * i // 8) for i in (1, 2, 4, 8)]))
+    print '%6s  %-10s %10s %12s %13s' % (
+        'apps', 'call', 'time (ms)', 'per app (us)', 'catalog loads')
+    for count in counts:
+        root = tempfile.mkdtemp(prefix='bench_inventory_')
+        try:
+            results = run(root, count, args.runs)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        for name in ('app_list', 'inventory'):
+            elapsed, loads = results[name]
+            print '%6d  %-10s %10.1f %12.1f %13d' % (
+                count, name, elapsed * 1000, elapsed * 1e6 / count, loads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Benchmark of the extraction of app packages
+
+    Builds a large app package - as a tar.gz and a zip archive - and
+    compares extract_archive, which sets the owner of the files while they
+    are written, with the former extraction by unzip or tar followed by the
+    recursive chown passes of app_install. The wall time and the CPU time -
+    of the process and its children - of each method are reported, and its
+    number of system calls if strace is available.
+
+    Run with:
+        python benchmarks/bench_extract_archive.py [--files 5000] [--size 4096]
+"""
+import os
+import sys
+import time
+import shutil
+import resource
+import tarfile
+import zipfile
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+from yunohost.utils.archive import extract_archive
+
+METHODS = ('noop', 'subprocess', 'in-process')
+
+
+def make_package(root, files, size):
+    """Write an app package of files files into root and archive it"""
+    src = os.path.join(root, 'package')
+    for i in range(files):
+        path = os.path.join(src, 'sources', 'dir%03d' % (i // 100),
+                            'file%05d' % i)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size // 2) + '\0' * (size - size // 2))
+    os.makedirs(os.path.join(src, 'scripts'))
+    with open(os.path.join(src, 'scripts', 'install'), 'w') as f:
+        f.write('#!/bin/bash\n')
+    os.chmod(os.path.join(src, 'scripts', 'install'), 0755)
+
+    archives = {}
+    archives['tar.gz'] = os.path.join(root, 'package.tar.gz')
+    with tarfile.open(archives['tar.gz'], 'w:gz') as tar:
+        tar.add(src, arcname='package')
+    archives['zip'] = os.path.join(root, 'package.zip')
+    with zipfile.ZipFile(archives['zip'], 'w', zipfile.ZIP_DEFLATED) as zf:
+        for dirpath, dirnames, filenames in os.walk(src):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                zf.write(path, os.path.relpath(path, root))
+    return archives
+
+
+def extract(method, archive, dest):
+    """Extract archive into dest as the given method does"""
+    uid, gid = os.getuid(), os.getgid()
+    if method == 'in-process':
+        extract_archive(archive, dest, uid, gid)
+    elif method == 'subprocess':
+        # As _extract_app_from_file and app_install used to do
+        os.makedirs(dest)
+        if archive.endswith('.zip'):
+            os.system('unzip %s -d %s > /dev/null 2>&1' % (archive, dest))
+        else:
+            os.system('tar -xf %s -C %s > /dev/null 2>&1' % (archive, dest))
+        os.system('chown -R %d:%d %s' % (uid, gid, dest))
+        os.system('chown -hR %d:%d %s' % (uid, gid, dest))
+
+
+def get_cpu_time():
+    """Return the CPU time used by the process and its children"""
+    t = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        r = resource.getrusage(who)
+        t += r.ru_utime + r.ru_stime
+    return t
+
+
+def count_syscalls(method, archive, dest):
+    """Return the number of system calls of an extraction, with strace"""
+    with tempfile.NamedTemporaryFile() as output:
+        subprocess.check_call([
+            'strace', '-f', '-c', '-o', output.name, sys.executable,
+            os.path.abspath(__file__), '--extract', method, archive, dest])
+        for line in output:
+            fields = line.split()
+            if fields and fields[-1] == 'total':
+                # Fields are time, seconds, usecs/call, calls[, errors]
+                return int(fields[3])
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--files', type=int, default=5000,
+                        help="Number of files of the package")
+    parser.add_argument('--size', type=int, default=4096,
+                        help="Size of each file in bytes")
+    parser.add_argument('--runs', type=int, default=3,
+                        help="Number of runs to keep the best time of")
+    parser.add_argument('--extract', nargs=3,
+                        metavar=('METHOD', 'ARCHIVE', 'DEST'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.extract:
+        extract(*args.extract)
+        return
+
+    has_strace = subprocess.call('command -v strace > /dev/null',
+                                 shell=True) == 0
+    root = tempfile.mkdtemp(prefix='bench_extract_')
+    try:
+        archives = make_package(root, args.files, args.size)
+        dest = os.path.join(root, 'dest')
+
+        print '%-7s %-11s %10s %10s %10s' % ('format', 'method', 'time (ms)',
+                                             'cpu (ms)', 'syscalls')
+        for fmt in ('tar.gz', 'zip'):
+            baseline = None
+            for method in METHODS:
+                best = best_cpu = None
+                for i in range(args.runs if method != 'noop' else 0):
+                    shutil.rmtree(dest, ignore_errors=True)
+                    start, start_cpu = time.time(), get_cpu_time()
+                    extract(method, archives[fmt], dest)
+                    elapsed = time.time() - start
+                    cpu = get_cpu_time() - start_cpu
+                    if best is None or elapsed < best:
+                        best = elapsed
+                    if best_cpu is None or cpu < best_cpu:
+                        best_cpu = cpu
+
+                calls = None
+                if has_strace:
+                    shutil.rmtree(dest, ignore_errors=True)
+                    calls = count_syscalls(method, archives[fmt], dest)
+                # Do not count the interpreter startup
+                if method == 'noop':
+                    baseline = calls or 0
+                    continue
+                print '%-7s %-11s %10.1f %10.1f %10s' % (
+                    fmt, method, best * 1000, best_cpu * 1000,
+                    calls - baseline if calls is not None else '-')
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
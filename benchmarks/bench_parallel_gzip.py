@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Benchmark of the parallel gzip writer of backup archives
+
+    Compresses the same data with ParallelGzipFile for an increasing number
+    of threads - up to the number of CPUs by default - and with the gzip
+    module as done before, and reports the throughput and the speedup over
+    a single thread. The output is checked to be readable by gzip.
+
+    Run with:
+        python benchmarks/bench_parallel_gzip.py [--size 256] [--jobs 8]
+"""
+import os
+import sys
+import gzip
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+from yunohost.utils.compression import ParallelGzipFile
+
+
+def make_data(size):
+    """Return size bytes of half compressible data"""
+    block = os.urandom(32 * 1024) + ' '.join(
+        str(i) for i in range(8 * 1024))[:32 * 1024]
+    return (block * (size // len(block) + 1))[:size]
+
+
+def compress(path, data, jobs, level):
+    """Write data into path and return the elapsed time"""
+    chunk = 64 * 1024
+    start = time.time()
+    if jobs is None:
+        f = gzip.GzipFile(path, 'wb', compresslevel=level)
+    else:
+        f = ParallelGzipFile(path, compresslevel=level, jobs=jobs)
+    for i in range(0, len(data), chunk):
+        f.write(data[i:i + chunk])
+    f.close()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--size', type=int, default=256,
+                        help="Size of the data to compress in MiB")
+    parser.add_argument('--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="Maximum number of threads")
+    parser.add_argument('--level', type=int, default=6,
+                        help="Compression level")
+    parser.add_argument('--runs', type=int, default=3,
+                        help="Number of runs to keep the best time of")
+    args = parser.parse_args()
+
+    data = make_data(args.size * 1024 * 1024)
+    jobs_list = [None] + sorted(set(
+        [j for j in (1, 2, 4, 8, 16, 32, 64) if j < args.jobs] + [args.jobs]))
+
+    tmp_dir = tempfile.mkdtemp(prefix='bench_gzip_')
+    path = os.path.join(tmp_dir, 'data.gz')
+    try:
+        print '%-8s %10s %12s %9s %12s' % (
+            'threads', 'time (s)', 'rate (MB/s)', 'speedup', 'ratio (%)')
+        single = None
+        for jobs in jobs_list:
+            best = min(compress(path, data, jobs, args.level)
+                       for i in range(args.runs))
+
+            with gzip.open(path, 'rb') as f:
+                if f.read() != data:
+                    sys.exit("Data compressed with %s threads is corrupted"
+                             % jobs)
+
+            if jobs == 1:
+                single = best
+            print '%-8s %10.2f %12.1f %9s %12.1f' % (
+                'gzip' if jobs is None else jobs, best,
+                len(data) / best / 1e6,
+                '%.2f' % (single / best) if single else '-',
+                os.path.getsize(path) * 100.0 / len(data))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
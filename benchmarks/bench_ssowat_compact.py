@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Benchmark of the SSOwat configuration formats
+
+    Generates the configuration of fake users and apps - some of them public
+    and the others allowed to groups of users - in the 'full' and 'compact'
+    formats of app_ssowatconf, and reports the size of the file, the time
+    to serialize it and to write it atomically, and the time to parse it.
+
+    Run with moulinette installed with:
+        python benchmarks/bench_ssowat_compact.py [--users 1000] [--apps 50]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+from yunohost import app
+
+
+def make_conf(users_count, apps_count, groups, seed=0):
+    """Return a configuration as app_ssowatconf builds it"""
+    rand = random.Random(seed)
+    usernames = ['user%05d' % i for i in range(users_count)]
+    # Users of a same group are allowed to the same private apps
+    members = [usernames[i::groups] for i in range(groups)]
+
+    apps_settings = {}
+    for i in range(apps_count):
+        settings = {
+            'id': 'app%03d' % i,
+            'label': 'App %d' % i,
+            'domain': 'domain%d.example.org' % (i % 3),
+            'path': '/app%d/' % i,
+        }
+        if i % 2:
+            settings['mode'] = 'private'
+            allowed = set()
+            for g in rand.sample(range(groups), max(1, groups // 3)):
+                allowed.update(members[g])
+            settings['allowed_users'] = ','.join(sorted(allowed))
+        apps_settings[settings['id']] = settings
+    public_map, private_maps = app._get_apps_access_index(apps_settings)
+
+    users = {}
+    for username in usernames:
+        users[username] = dict(public_map)
+        users[username].update(private_maps.get(username, {}))
+
+    return {
+        'portal_domain': 'domain0.example.org',
+        'portal_path': '/yunohost/sso/',
+        'domains': ['domain%d.example.org' % i for i in range(3)],
+        'skipped_urls': [],
+        'users': users,
+    }
+
+
+def measure(conf_dict, mode, path, runs):
+    best = {}
+    for i in range(runs):
+        timings = {}
+        start = time.time()
+        conf = app._dump_ssowat_conf(conf_dict, mode)
+        timings['dump'] = time.time() - start
+
+        start = time.time()
+        app._write_file_atomically(path, conf)
+        timings['write'] = time.time() - start
+
+        start = time.time()
+        json.loads(conf)
+        timings['parse'] = time.time() - start
+
+        for k, v in timings.items():
+            best[k] = min(best.get(k, v), v)
+    return len(conf), best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--users', type=int, default=1000,
+                        help="Number of users")
+    parser.add_argument('--apps', type=int, default=50,
+                        help="Number of installed apps")
+    parser.add_argument('--groups', type=int, default=10,
+                        help="Number of groups of users sharing the same apps")
+    parser.add_argument('--runs', type=int, default=5,
+                        help="Number of runs to keep the best time of")
+    args = parser.parse_args()
+
+    conf_dict = make_conf(args.users, args.apps, args.groups)
+    tmp_dir = tempfile.mkdtemp(prefix='bench_ssowat_')
+    try:
+        print '%-8s %12s %10s %11s %11s' % (
+            'mode', 'size (kB)', 'dump (ms)', 'write (ms)', 'parse (ms)')
+        for mode in ('full', 'compact'):
+            size, timings = measure(conf_dict, mode,
+                                    os.path.join(tmp_dir, 'conf.json'),
+                                    args.runs)
+            print '%-8s %12.1f %10.1f %11.1f %11.1f' % (
+                mode, size / 1024.0, timings['dump'] * 1000,
+                timings['write'] * 1000, timings['parse'] * 1000)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
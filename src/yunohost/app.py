@@ -25,6 +25,8 @@
 """
 import os
 import sys
+import pwd
+import copy
 import json
 import shutil
 import stat
@@ -33,14 +35,23 @@ import time
 import re
 import socket
 import urlparse
+import Queue
 import errno
+import tarfile
+import hashlib
+import tempfile
+import threading
+import requests
 import subprocess
+from multiprocessing.pool import ThreadPool
 
 from moulinette.core import MoulinetteError
 from moulinette.utils.log import getActionLogger
 
 from yunohost.service import service_log
 from yunohost.utils import packages
+from yunohost.utils.archive import extract_archive, ArchiveError
+from yunohost.utils.permissions import apply_permissions
 
 logger = getActionLogger('yunohost.app')
 
@@ -49,6 +60,13 @@ apps_path        = '/usr/share/yunohost/apps'
 apps_setting_path= '/etc/yunohost/apps/'
 install_tmp      = '/var/cache/yunohost'
 app_tmp_folder   = install_tmp + '/from_file'
+apps_catalog_cache = install_tmp + '/apps_catalog.json'
+apps_locations_cache = install_tmp + '/apps_locations.json'
+apps_instances_cache = install_tmp + '/apps_instances.json'
+app_sources_cache = install_tmp + '/sources'
+app_sources_cache_size = 512 * 1024 * 1024
+app_fetch_workers = 2
+ssowat_compact_flag = '/etc/yunohost/ssowat_compact'
 
 re_github_repo = re.compile(
     r'^(http[s]?://|git@)github.com[/:]'
@@ -56,6 +74,22 @@ re_github_repo = re.compile(
     '(/tree/(?P<tree>.+))?'
 )
 
+# In-process copy of the compiled apps catalog - see _get_apps_catalog()
+_apps_catalog = None
+
+# In-process copy of the apps locations index - see _get_apps_locations()
+_apps_locations = None
+
+# In-process copy of the apps instances index - see _get_apps_instances()
+_apps_instances = None
+_apps_instances_lock = threading.RLock()
+
+# In-process cache of apps settings by file - see _get_app_settings()
+_apps_settings_cache = {}
+
+# Use the LibYAML based loader if available
+_yaml_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 
 def app_listlists():
     """
@@ -66,7 +100,7 @@ def app_listlists():
     list_list = []
     try:
         for filename in os.listdir(repo_path):
-            if '.json' in filename:
+            if filename.endswith('.json'):
                 list_list.append(filename[:len(filename)-5])
     except OSError:
         raise MoulinetteError(1, m18n.n('no_appslist_found'))
@@ -96,15 +130,63 @@ def app_fetchlist(url=None, name=None):
                                   m18n.n('custom_appslist_name_required'))
 
     list_file = '%s/%s.json' % (repo_path, name)
-    if os.system('wget "%s" -O "%s.tmp"' % (url, list_file)) != 0:
-        os.remove('%s.tmp' % list_file)
+    validators_file = '%s/%s.validators' % (repo_path, name)
+
+    # Retrieve validators of the fetched list to only get it again if changed
+    headers = {}
+    try:
+        with open(validators_file) as f:
+            validators = json.load(f)
+        if validators.get('url') == url and os.path.isfile(list_file):
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+    except (IOError, ValueError, AttributeError):
+        pass
+
+    try:
+        r = requests.get(url, headers=headers, timeout=30)
+        if r.status_code == 304 and not headers:
+            # There is no cached list which could be unchanged
+            raise ValueError('unexpected 304 response')
+        elif r.status_code != 304:
+            r.raise_for_status()
+            json.loads(r.content)
+    except (requests.RequestException, ValueError):
+        logger.debug('unable to fetch apps list from %s', url, exc_info=1)
         raise MoulinetteError(errno.EBADR, m18n.n('appslist_retrieve_error'))
 
-    # Rename fetched temp list
-    os.rename('%s.tmp' % list_file, list_file)
+    if r.status_code == 304:
+        logger.info(m18n.n('appslist_unchanged'))
+    else:
+        # Only replace the list if its content has changed, so that the apps
+        # catalog is not compiled again
+        try:
+            with open(list_file) as f:
+                changed = f.read() != r.content
+        except IOError:
+            changed = True
+        if changed:
+            _write_file_atomically(list_file, r.content)
+
+        validators = {
+            'url': url,
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+        }
+        _write_file_atomically(validators_file, json.dumps(validators))
 
-    os.system("touch /etc/cron.d/yunohost-applist-%s" % name)
-    os.system("echo '00 00 * * * root yunohost app fetchlist -u %s -n %s > /dev/null 2>&1' >/etc/cron.d/yunohost-applist-%s" % (url, name, name))
+    cron_file = '/etc/cron.d/yunohost-applist-%s' % name
+    cron_entry = ('00 00 * * * root yunohost app fetchlist -u %s -n %s '
+                  '> /dev/null 2>&1\n' % (url, name))
+    try:
+        with open(cron_file) as f:
+            changed = f.read() != cron_entry
+    except IOError:
+        changed = True
+    if changed:
+        _write_file_atomically(cron_file, cron_entry)
 
     logger.success(m18n.n('appslist_fetched'))
 
@@ -122,6 +204,10 @@ def app_removelist(name):
         os.remove("/etc/cron.d/yunohost-applist-%s" % name)
     except OSError:
         raise MoulinetteError(errno.ENOENT, m18n.n('appslist_unknown'))
+    try:
+        os.remove('%s/%s.validators' % (repo_path, name))
+    except OSError:
+        pass
 
     logger.success(m18n.n('appslist_removed'))
 
@@ -145,46 +231,19 @@ def app_list(offset=None, limit=None, filter=None, raw=False, installed=False, w
     else: limit = 1000
     installed = with_backup or installed
 
-    app_dict = {}
     if raw:
         list_dict = {}
     else:
         list_dict = []
 
-    try:
-        applists = app_listlists()['lists']
-        applists[0]
-    except (IOError, IndexError):
-        app_fetchlist()
-        applists = app_listlists()['lists']
-
-    for applist in applists:
-        with open(os.path.join(repo_path, applist + '.json')) as json_list:
-            for app, info in json.loads(str(json_list.read())).items():
-                if app not in app_dict:
-                    info['repository'] = applist
-                    app_dict[app] = info
-
-    for app in os.listdir(apps_setting_path):
-        if app not in app_dict:
-            # Look for forks
-            if '__' in app:
-                original_app = app[:app.index('__')]
-                if original_app in app_dict:
-                    app_dict[app] = app_dict[original_app]
-                    continue
-            with open( apps_setting_path + app +'/manifest.json') as json_manifest:
-                app_dict[app] = {"manifest":json.loads(str(json_manifest.read()))}
-            app_dict[app]['repository'] = None
-
-    if len(app_dict) > (0 + offset) and limit > 0:
-        sorted_app_dict = {}
-        for sorted_keys in sorted(app_dict.keys())[offset:]:
-            sorted_app_dict[sorted_keys] = app_dict[sorted_keys]
+    app_dict = _get_apps_catalog()
+    inventory = None
 
+    if len(app_dict['order']) > (0 + offset) and limit > 0:
         i = 0
-        for app_id, app_info_dict in sorted_app_dict.items():
+        for app_id in app_dict['order'][offset:]:
             if i < limit:
+                app_info_dict = dict(app_dict['apps'][app_id])
                 if (filter and ((filter in app_id) or (filter in app_info_dict['manifest']['name']))) or not filter:
                     app_installed = _is_installed(app_id)
 
@@ -207,8 +266,9 @@ def app_list(offset=None, limit=None, filter=None, raw=False, installed=False, w
                     else:
                         label = None
                         if app_installed:
-                            app_info_dict_raw = app_info(app=app_id, raw=True)
-                            label = app_info_dict_raw['settings']['label']
+                            if inventory is None:
+                                inventory = _get_apps_inventory()
+                            label = inventory[app_id]['settings']['label']
                         list_dict.append({
                             'id': app_id,
                             'name': app_info_dict['manifest']['name'],
@@ -242,7 +302,9 @@ def app_info(app, show_status=False, raw=False):
         raise MoulinetteError(errno.EINVAL,
                               m18n.n('app_not_installed', app=app))
     if raw:
-        ret = app_list(filter=app, raw=True)[app]
+        ret = dict(_get_apps_catalog()['apps'][app])
+        ret['installed'] = True
+        ret['status'] = _get_app_status(app)
         ret['settings'] = _get_app_settings(app)
         return ret
 
@@ -331,7 +393,7 @@ def app_upgrade(auth, app=[], url=None, file=None):
     from yunohost.hook import hook_add, hook_remove, hook_exec
 
     try:
-        app_list()
+        inventory = _get_apps_inventory()
     except MoulinetteError:
         raise MoulinetteError(errno.ENODATA, m18n.n('app_no_upgrade'))
 
@@ -340,26 +402,28 @@ def app_upgrade(auth, app=[], url=None, file=None):
     # If no app is specified, upgrade all apps
     if not app:
         if (not url and not file):
-            app = os.listdir(apps_setting_path)
+            app = inventory.keys()
     elif not isinstance(app, list):
         app = [ app ]
 
+    # Retrieve apps to upgrade and how to fetch their sources
+    apps_to_upgrade = []
     for app_id in app:
-        installed = _is_installed(app_id)
+        installed = app_id in inventory
         if not installed:
             raise MoulinetteError(errno.ENOPKG,
                                   m18n.n('app_not_installed', app=app_id))
 
-        if app_id in upgraded_apps:
+        if app_id in [a[0] for a in apps_to_upgrade]:
             continue
 
-        current_app_dict = app_info(app_id,  raw=True)
-        new_app_dict     = app_info(app_id, raw=True)
+        current_app_dict = inventory[app_id]
+        new_app_dict     = inventory[app_id]
 
         if file:
-            manifest = _extract_app_from_file(file)
+            fetch = (_extract_app_from_file, file)
         elif url:
-            manifest = _fetch_app_from_git(url)
+            fetch = (_fetch_app_from_git, url)
         elif new_app_dict is None or 'lastUpdate' not in new_app_dict or 'git' not in new_app_dict:
             logger.warning(m18n.n('custom_app_url_required', app=app_id))
             continue
@@ -368,51 +432,75 @@ def app_upgrade(auth, app=[], url=None, file=None):
                    and (new_app_dict['lastUpdate'] > current_app_dict['settings']['install_time'])) \
               or ('update_time' in current_app_dict['settings'] \
                    and (new_app_dict['lastUpdate'] > current_app_dict['settings']['update_time'])):
-            manifest = _fetch_app_from_git(app_id)
+            fetch = (_fetch_app_from_git, app_id)
         else:
             continue
+        apps_to_upgrade.append((app_id, fetch))
 
-        # Check requirements
-        _check_manifest_requirements(manifest)
+    # Fetch the sources of the next apps in background - each one in its own
+    # folder - while upgrade scripts are executed one at a time
+    context = _LookupContext(auth)
+    work_dir = _make_work_dir('upgrade_')
 
-        app_setting_path = apps_setting_path +'/'+ app_id
+    pool = ThreadPool(app_fetch_workers)
+    try:
+        fetches = []
+        for app_id, (fetch_func, source) in apps_to_upgrade:
+            app_folder = os.path.join(work_dir, app_id)
+            fetches.append((app_id, app_folder, pool.apply_async(
+                fetch_func, [source], {'folder': app_folder})))
+        pool.close()
 
-        # Retrieve current app status
-        status = _get_app_status(app_id)
-        status['remote'] = manifest.get('remote', None)
+        for app_id, app_folder, fetch in fetches:
+            manifest = fetch.get()
 
-        # Clean hooks and add new ones
-        hook_remove(app_id)
-        if 'hooks' in os.listdir(app_tmp_folder):
-            for hook in os.listdir(app_tmp_folder +'/hooks'):
-                hook_add(app_id, app_tmp_folder +'/hooks/'+ hook)
+            # Check requirements
+            _check_manifest_requirements(manifest)
 
-        # Retrieve arguments list for upgrade script
-        # TODO: Allow to specify arguments
-        args_list = _parse_args_from_manifest(manifest, 'upgrade', auth=auth)
-        args_list.append(app_id)
+            app_setting_path = apps_setting_path +'/'+ app_id
 
-        # Execute App upgrade script
-        os.system('chown -hR admin: %s' % install_tmp)
-        if hook_exec(app_tmp_folder +'/scripts/upgrade', args_list) != 0:
-            logger.error(m18n.n('app_upgrade_failed', app=app_id))
-        else:
-            now = int(time.time())
-            # TODO: Move install_time away from app_setting
-            app_setting(app_id, 'update_time', now)
-            status['upgraded_at'] = now
+            # Retrieve current app status
+            status = dict(inventory[app_id]['status'])
+            status['remote'] = manifest.get('remote', None)
+
+            # Clean hooks and add new ones
+            hook_remove(app_id)
+            if 'hooks' in os.listdir(app_folder):
+                for hook in os.listdir(app_folder +'/hooks'):
+                    hook_add(app_id, app_folder +'/hooks/'+ hook)
+
+            # Retrieve arguments list for upgrade script
+            # TODO: Allow to specify arguments
+            args_list = _parse_args_from_manifest(manifest, 'upgrade',
+                                                  auth=auth, context=context)
+            args_list.append(app_id)
+
+            # Execute App upgrade script
+            if hook_exec(app_folder +'/scripts/upgrade', args_list) != 0:
+                logger.error(m18n.n('app_upgrade_failed', app=app_id))
+            else:
+                now = int(time.time())
+                # TODO: Move install_time away from app_setting
+                app_setting(app_id, 'update_time', now)
+                status['upgraded_at'] = now
+
+                # Store app status
+                with open(app_setting_path + '/status.json', 'w+') as f:
+                    json.dump(status, f)
 
-            # Store app status
-            with open(app_setting_path + '/status.json', 'w+') as f:
-                json.dump(status, f)
+                # Replace scripts and manifest
+                os.system('rm -rf "%s/scripts" "%s/manifest.json"' % (app_setting_path, app_setting_path))
+                os.system('mv "%s/manifest.json" "%s/scripts" %s' % (app_folder, app_folder, app_setting_path))
 
-            # Replace scripts and manifest
-            os.system('rm -rf "%s/scripts" "%s/manifest.json"' % (app_setting_path, app_setting_path))
-            os.system('mv "%s/manifest.json" "%s/scripts" %s' % (app_tmp_folder, app_tmp_folder, app_setting_path))
+                # So much win
+                upgraded_apps.append(app_id)
+                logger.success(m18n.n('app_upgraded', app=app_id))
 
-            # So much win
-            upgraded_apps.append(app_id)
-            logger.success(m18n.n('app_upgraded', app=app_id))
+            shutil.rmtree(app_folder, ignore_errors=True)
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(work_dir, ignore_errors=True)
 
     if not upgraded_apps:
         raise MoulinetteError(errno.ENODATA, m18n.n('app_no_upgrade'))
@@ -432,46 +520,16 @@ def app_install(auth, app, label=None, args=None):
         args -- Serialize arguments for app installation
 
     """
-    from yunohost.hook import hook_add, hook_remove, hook_exec
-
     # Fetch or extract sources
     try: os.listdir(install_tmp)
     except OSError: os.makedirs(install_tmp)
 
-    status = {
-        'installed_at': int(time.time()),
-        'upgraded_at': None,
-        'remote': {
-            'type': None,
-        },
-    }
-
-    if app in app_list(raw=True) or ('@' in app) or ('http://' in app) or ('https://' in app):
-        manifest = _fetch_app_from_git(app)
-    elif os.path.exists(app):
-        manifest = _extract_app_from_file(app)
-    else:
-        raise MoulinetteError(errno.EINVAL, m18n.n('app_unknown'))
-    status['remote'] = manifest.get('remote', {})
-
-    # Check ID
-    if 'id' not in manifest or '__' in manifest['id']:
-        raise MoulinetteError(errno.EINVAL, m18n.n('app_id_invalid'))
-
-    app_id = manifest['id']
+    manifest = _fetch_app_sources(app)
 
     # Check requirements
     _check_manifest_requirements(manifest)
 
-    # Check if app can be forked
-    instance_number = _installed_instance_number(app_id, last=True) + 1
-    if instance_number > 1 :
-        if 'multi_instance' not in manifest or not is_true(manifest['multi_instance']):
-            raise MoulinetteError(errno.EEXIST,
-                                  m18n.n('app_already_installed', app=app_id))
-
-        # Change app_id to the forked app id
-        app_id = app_id + '__' + str(instance_number)
+    app_id = _get_app_instance_id(manifest)
 
     # Retrieve arguments list for install script
     args_dict = {} if not args else \
@@ -479,76 +537,121 @@ def app_install(auth, app, label=None, args=None):
     args_list = _parse_args_from_manifest(manifest, 'install', args_dict, auth)
     args_list.append(app_id)
 
-    # Create app directory
-    app_setting_path = os.path.join(apps_setting_path, app_id)
-    if os.path.exists(app_setting_path):
-        shutil.rmtree(app_setting_path)
-    os.makedirs(app_setting_path)
+    _install_app(app_id, manifest, app_tmp_folder, label, args_list)
 
-    # Clean hooks and add new ones
-    hook_remove(app_id)
-    if 'hooks' in os.listdir(app_tmp_folder):
-        for file in os.listdir(app_tmp_folder +'/hooks'):
-            hook_add(app_id, app_tmp_folder +'/hooks/'+ file)
+    app_ssowatconf(auth)
 
-    # Set initial app settings
-    app_settings = {
-        'id': app_id,
-        'label': label if label else manifest['name'],
-    }
-    # TODO: Move install_time away from app settings
-    app_settings['install_time'] = status['installed_at']
-    _set_app_settings(app_id, app_settings)
+    logger.success(m18n.n('installation_complete'))
 
-    os.system('chown -R admin: '+ app_tmp_folder)
 
-    # Execute App install script
-    os.system('chown -hR admin: %s' % install_tmp)
-    # Move scripts and manifest to the right place
-    os.system('cp %s/manifest.json %s' % (app_tmp_folder, app_setting_path))
-    os.system('cp -R %s/scripts %s' % (app_tmp_folder, app_setting_path))
+def app_installmany(auth, apps, jobs=1):
+    """
+    Install several apps at once
 
-    # Execute the app install script
-    install_retcode = 1
-    try:
-        install_retcode = hook_exec(
-            os.path.join(app_tmp_folder, 'scripts/install'), args_list)
-    except (KeyboardInterrupt, EOFError):
-        install_retcode = -1
-    except:
-        logger.exception(m18n.n('unexpected_error'))
-    finally:
-        if install_retcode != 0:
-            # Execute remove script
-            remove_retcode = hook_exec(
-                os.path.join(app_tmp_folder, 'scripts/remove'), [app_id])
-            if remove_retcode != 0:
-                logger.warning(m18n.n('app_not_properly_removed', app=app_id))
+    Sources of the apps are fetched concurrently, then their arguments are
+    parsed and they are installed in an order which satisfies dependencies
+    between them - given by their app arguments. Up to
+    `jobs` install scripts are executed concurrently, except for apps which
+    are installed on the same domain.
 
-            # Clean tmp folders
-            hook_remove(app_id)
-            shutil.rmtree(app_setting_path)
-            shutil.rmtree(app_tmp_folder)
+    Keyword argument:
+        apps -- YAML or JSON list of apps to install - each one with an
+            'app' and an optional 'label' and 'args' - or path of a file
+            containing it
+        jobs -- Maximum number of apps to install concurrently
 
-            if install_retcode == -1:
-                raise MoulinetteError(errno.EINTR,
-                                      m18n.g('operation_interrupted'))
-            raise MoulinetteError(errno.EIO, m18n.n('installation_failed'))
+    """
+    entries = _parse_apps_install_list(apps)
+    jobs = max(int(jobs or 1), 1)
 
-    # Store app status
-    with open(app_setting_path + '/status.json', 'w+') as f:
-        json.dump(status, f)
+    work_dir = _make_work_dir('install_')
 
-    # Clean and set permissions
-    shutil.rmtree(app_tmp_folder)
-    os.system('chmod -R 400 %s' % app_setting_path)
-    os.system('chown -R root: %s' % app_setting_path)
-    os.system('chown -R admin: %s/scripts' % app_setting_path)
+    # Fetch and install with distinct pools so that a slow fetch never
+    # holds an installation slot
+    fetch_pool = ThreadPool(app_fetch_workers)
+    pool = ThreadPool(jobs)
+    try:
+        # Fetch all sources concurrently, each one in its own folder
+        folders = [os.path.join(work_dir, str(i)) for i in range(len(entries))]
+        fetches = [fetch_pool.apply_async(_fetch_app_sources, [entry['app']],
+                                          {'folder': folder})
+                   for entry, folder in zip(entries, folders)]
+        manifests = [fetch.get() for fetch in fetches]
+
+        # Allocate the id of each app instance
+        app_ids = []
+        for manifest in manifests:
+            _check_manifest_requirements(manifest)
+            app_ids.append(_get_app_instance_id(manifest, app_ids))
+
+        order, dependencies = _sort_apps_install_list(
+            entries, manifests, app_ids)
+
+        # Parse arguments one app at a time since they may be asked
+        context = _LookupContext(auth)
+        args_lists, domains = {}, {}
+        for i in order:
+            args_lists[i] = _parse_args_from_manifest(
+                manifests[i], 'install', entries[i]['args'], auth,
+                pending_apps=app_ids, context=context)
+            args_lists[i].append(app_ids[i])
+            domains[i] = set(value for arg, value in zip(
+                    manifests[i].get('arguments', {}).get('install', []),
+                    args_lists[i])
+                if arg.get('type') == 'domain' and value)
+
+        # Install apps whose dependencies are installed and which do not
+        # share a domain with a running installation
+        results = Queue.Queue()
+        pending, running, installed, failed = list(order), set(), [], []
+        while pending or running:
+            for i in list(pending):
+                if len(running) >= jobs:
+                    break
+                failed_dependencies = dependencies[i] & set(failed)
+                if failed_dependencies:
+                    logger.error(m18n.n('app_install_dependency_failed',
+                        app=app_ids[i],
+                        dependency=app_ids[min(failed_dependencies)]))
+                    pending.remove(i)
+                    failed.append(i)
+                    continue
+                if not dependencies[i].issubset(installed) \
+                        or any(domains[i] & domains[r] for r in running):
+                    continue
+                pending.remove(i)
+                running.add(i)
+                pool.apply_async(_install_app_in_thread, [results, i,
+                    app_ids[i], manifests[i], folders[i],
+                    entries[i]['label'], args_lists[i]])
+            if not running:
+                continue
 
-    app_ssowatconf(auth)
+            i, error = results.get()
+            running.remove(i)
+            if error is None:
+                installed.append(i)
+                logger.success(m18n.n('app_installed', app=app_ids[i]))
+            else:
+                failed.append(i)
+                logger.error(m18n.n('app_install_failed', app=app_ids[i],
+                    error=getattr(error, 'strerror', None) or str(error)))
+    finally:
+        for p in (fetch_pool, pool):
+            p.terminate()
+            p.join()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if installed:
+        app_ssowatconf(auth)
+
+    if failed:
+        raise MoulinetteError(errno.EIO, m18n.n('installation_failed'))
 
     logger.success(m18n.n('installation_complete'))
 
+    return { 'installed': [app_ids[i] for i in installed] }
+
 
 def app_remove(auth, app):
     """
@@ -571,9 +674,11 @@ def app_remove(auth, app):
         shutil.rmtree('/tmp/yunohost_remove')
     except: pass
 
-    os.system('cp -a %s /tmp/yunohost_remove && chown -hR admin: /tmp/yunohost_remove' % app_setting_path)
-    os.system('chown -R admin: /tmp/yunohost_remove')
-    os.system('chmod -R u+rX /tmp/yunohost_remove')
+    shutil.copytree(app_setting_path, '/tmp/yunohost_remove', symlinks=True)
+    apply_permissions('/tmp/yunohost_remove', [
+        ('*', 'admin', lambda mode, is_dir:
+            mode | (0500 if is_dir or mode & 0111 else 0400)),
+    ])
 
     args_list = [app]
 
@@ -581,6 +686,8 @@ def app_remove(auth, app):
         logger.success(m18n.n('app_removed', app=app))
 
     if os.path.exists(app_setting_path): shutil.rmtree(app_setting_path)
+    _update_app_location(app, None)
+    _update_apps_instances(app, False)
     shutil.rmtree('/tmp/yunohost_remove')
     hook_remove(app)
     app_ssowatconf(auth)
@@ -595,48 +702,12 @@ def app_addaccess(auth, apps, users=[]):
         apps
 
     """
-    from yunohost.user import user_list, user_info
-    from yunohost.hook import hook_callback
-
-    result = {}
-
-    if not users:
-        users = user_list(auth)['users'].keys()
-    elif not isinstance(users, list):
-        users = [users,]
     if not isinstance(apps, list):
         apps = [apps,]
+    if users and not isinstance(users, list):
+        users = [users,]
 
-    for app in apps:
-        app_settings = _get_app_settings(app)
-        if not app_settings:
-            continue
-
-        if 'mode' not in app_settings:
-            app_setting(app, 'mode', 'private')
-            app_settings['mode'] = 'private'
-
-        if app_settings['mode'] == 'private':
-            allowed_users = set()
-            if 'allowed_users' in app_settings:
-                allowed_users = set(app_settings['allowed_users'].split(','))
-
-            for allowed_user in users:
-                if allowed_user not in allowed_users:
-                    try:
-                        user_info(auth, allowed_user)
-                    except MoulinetteError:
-                        logger.warning(m18n.n('user_unknown', user=allowed_user))
-                        continue
-                    allowed_users.add(allowed_user)
-
-            new_users = ','.join(allowed_users)
-            app_setting(app, 'allowed_users', new_users)
-            hook_callback('post_app_addaccess', args=[app, new_users])
-
-            result[app] = allowed_users
-
-    app_ssowatconf(auth)
+    result = _apply_access_changes(auth, [('add', apps, users or None)])
 
     return { 'allowed_users': result }
 
@@ -650,44 +721,12 @@ def app_removeaccess(auth, apps, users=[]):
         apps
 
     """
-    from yunohost.user import user_list
-    from yunohost.hook import hook_callback
-
-    result = {}
-
-    remove_all = False
-    if not users:
-        remove_all = True
-    elif not isinstance(users, list):
-        users = [users,]
     if not isinstance(apps, list):
         apps = [apps,]
+    if users and not isinstance(users, list):
+        users = [users,]
 
-    for app in apps:
-        app_settings = _get_app_settings(app)
-        if not app_settings:
-            continue
-        allowed_users = set()
-
-        if app_settings.get('skipped_uris', '') != '/':
-            if remove_all:
-                pass
-            elif 'allowed_users' in app_settings:
-                for allowed_user in app_settings['allowed_users'].split(','):
-                    if allowed_user not in users:
-                        allowed_users.add(allowed_user)
-            else:
-                for allowed_user in user_list(auth)['users'].keys():
-                    if allowed_user not in users:
-                        allowed_users.add(allowed_user)
-
-            new_users = ','.join(allowed_users)
-            app_setting(app, 'allowed_users', new_users)
-            hook_callback('post_app_removeaccess', args=[app, new_users])
-
-            result[app] = allowed_users
-
-    app_ssowatconf(auth)
+    result = _apply_access_changes(auth, [('remove', apps, users or None)])
 
     return { 'allowed_users': result }
 
@@ -700,24 +739,53 @@ def app_clearaccess(auth, apps):
         apps
 
     """
-    from yunohost.hook import hook_callback
-
     if not isinstance(apps, list): apps = [apps]
 
-    for app in apps:
-        app_settings = _get_app_settings(app)
-        if not app_settings:
-            continue
+    _apply_access_changes(auth, [('clear', apps, None)])
 
-        if 'mode' in app_settings:
-            app_setting(app, 'mode', delete=True)
 
-        if 'allowed_users' in app_settings:
-            app_setting(app, 'allowed_users', delete=True)
+def app_applyaccess(auth, changeset):
+    """
+    Apply several access rights changes at once
 
-        hook_callback('post_app_clearaccess', args=[app])
+    The changeset is a YAML or JSON list of changes, each one having an
+    'action' - one of 'add', 'remove' or 'clear' - the 'apps' to change
+    and optionally the 'users' to grant or revoke (everyone by default).
+    Changes are applied in order, and the SSOwat configuration is only
+    regenerated once.
 
-    app_ssowatconf(auth)
+    Keyword argument:
+        changeset -- Path of the changeset file, or the changeset itself
+
+    """
+    try:
+        if os.path.isfile(changeset):
+            with open(changeset) as f:
+                changeset = f.read()
+        changeset = yaml.load(changeset, Loader=_yaml_loader)
+    except (IOError, yaml.YAMLError) as e:
+        raise MoulinetteError(errno.EINVAL,
+            m18n.n('app_access_changeset_invalid', error=str(e)))
+
+    changes = []
+    for change in changeset if isinstance(changeset, list) else [None]:
+        if not isinstance(change, dict) \
+                or change.get('action') not in ['add', 'remove', 'clear'] \
+                or not change.get('apps'):
+            raise MoulinetteError(errno.EINVAL,
+                m18n.n('app_access_changeset_invalid',
+                       error=json.dumps(change)))
+        apps, users = change['apps'], change.get('users') or None
+        if not isinstance(apps, list):
+            apps = [apps,]
+        if users is not None and not isinstance(users, list):
+            users = [users,]
+        changes.append((change['action'], [str(a) for a in apps],
+                        users and [str(u) for u in users]))
+
+    result = _apply_access_changes(auth, changes)
+
+    return { 'allowed_users': result }
 
 
 def app_debug(app):
@@ -763,7 +831,7 @@ def app_makedefault(auth, app, domain=None):
     elif domain not in domain_list(auth)['domains']:
         raise MoulinetteError(errno.EINVAL, m18n.n('domain_unknown'))
 
-    if '/' in app_map(raw=True)[domain]:
+    if _lookup_app_location(domain, '/')[0] is not None:
         raise MoulinetteError(errno.EEXIST,
                               m18n.n('app_location_already_used'))
 
@@ -816,6 +884,56 @@ def app_setting(app, key, value=None, delete=False):
         _set_app_settings(app, app_settings)
 
 
+def app_settingmany(app, get=[], set=[], delete=[], nul=False):
+    """
+    Get, set or delete several app settings at once
+
+    Keyword argument:
+        app -- App ID
+        get -- Keys to get
+        set -- Settings to set (i.e. "key=value")
+        delete -- Keys to delete
+        nul -- Write the values of the keys to get on the standard output,
+            each one followed by a NUL byte, instead of returning them
+
+    Returns:
+        The values of the keys to get - in the given order - or an empty
+        string for unset keys
+
+    """
+    app_settings = _get_app_settings(app) or {}
+
+    if set or delete:
+        for key in delete:
+            if key in app_settings:
+                del app_settings[key]
+        for setting in set:
+            key, sep, value = setting.partition('=')
+            if not sep or not key:
+                raise MoulinetteError(errno.EINVAL,
+                    m18n.n('app_setting_invalid', setting=setting))
+            # FIXME: Allow multiple values for some keys?
+            if key in ['redirected_urls','redirected_regex']:
+                value = yaml.load(value)
+            app_settings[key] = value
+        _set_app_settings(app, app_settings)
+
+    if get:
+        values = []
+        for key in get:
+            if key not in app_settings:
+                logger.info("cannot get app setting '%s' for '%s'", key, app)
+            values.append(app_settings.get(key, ''))
+
+        # Let shell scripts read values which may contain new lines
+        if nul and msettings.get('interface') != 'api':
+            for value in values:
+                sys.stdout.write(u'{0}\0'.format(value).encode('utf-8'))
+            sys.stdout.flush()
+            return None
+        return values
+
+
 def app_checkport(port):
     """
     Check availability of a local port
@@ -862,23 +980,21 @@ def app_checkurl(auth, url, app=None):
     if path[-1:] != '/':
         path = path + '/'
 
-    apps_map = app_map(raw=True)
-
     if domain not in domain_list(auth)['domains']:
         raise MoulinetteError(errno.EINVAL, m18n.n('domain_unknown'))
 
-    if domain in apps_map:
-        for p, a in apps_map[domain].items():
-            # Skip requested app checking
-            if app is not None and a['id'] == app:
-                installed = True
-                continue
-            if path == p:
-                raise MoulinetteError(errno.EINVAL,
-                                      m18n.n('app_location_already_used'))
-            elif path.startswith(p) and p.count('/') < path.count('/'):
-                raise MoulinetteError(errno.EPERM,
-                                      m18n.n('app_location_install_failed'))
+    # Skip requested app checking
+    if app is not None:
+        app_location = _get_apps_locations()['apps'].get(app)
+        installed = app_location is not None and app_location[0] == domain
+
+    mounted_app, parent = _lookup_app_location(domain, path, ignore=app)
+    if mounted_app is not None:
+        raise MoulinetteError(errno.EINVAL,
+                              m18n.n('app_location_already_used'))
+    elif parent[0] is not None:
+        raise MoulinetteError(errno.EPERM,
+                              m18n.n('app_location_install_failed'))
 
     if app is not None and not installed:
         app_setting(app, 'domain', value=domain)
@@ -918,10 +1034,13 @@ def app_initdb(user, password=None, db=None, sql=None):
     logger.success(m18n.n('mysql_db_initialized'))
 
 
-def app_ssowatconf(auth):
+def app_ssowatconf(auth, mode=None):
     """
     Regenerate SSOwat configuration file
 
+    Keyword argument:
+        mode -- Format of the users section, 'full' or 'compact' (the
+            last one used by default)
 
     """
     from yunohost.domain import domain_list
@@ -932,9 +1051,26 @@ def app_ssowatconf(auth):
 
     domains = domain_list(auth)['domains']
 
+    # Retrieve installed apps settings and index their access rules
+    apps_settings = {}
+    for app_id in os.listdir(apps_setting_path):
+        app_settings = _get_app_settings(app_id)
+        if app_settings:
+            apps_settings[app_id] = app_settings
+    public_map, private_maps = _get_apps_access_index(apps_settings)
+
+    # Retrieve and store the users section mode
+    if mode is None:
+        mode = 'compact' if os.path.exists(ssowat_compact_flag) else 'full'
+    elif mode == 'compact':
+        open(ssowat_compact_flag, 'a').close()
+    elif os.path.exists(ssowat_compact_flag):
+        os.remove(ssowat_compact_flag)
+
     users = {}
     for username in user_list(auth)['users'].keys():
-        users[username] = app_map(user=username)
+        users[username] = dict(public_map)
+        users[username].update(private_maps.get(username, {}))
 
     skipped_urls = []
     skipped_regex = []
@@ -945,42 +1081,34 @@ def app_ssowatconf(auth):
     redirected_regex = { main_domain +'/yunohost[\/]?$': 'https://'+ main_domain +'/yunohost/sso/' }
     redirected_urls ={}
 
-    apps = {}
-    try:
-        apps_list = app_list()['apps']
-    except:
-        apps_list = []
-
     def _get_setting(settings, name):
         s = settings.get(name, None)
         return s.split(',') if s else []
 
-    for app in apps_list:
-        if _is_installed(app['id']):
-            with open(apps_setting_path + app['id'] +'/settings.yml') as f:
-                app_settings = yaml.load(f)
-                for item in _get_setting(app_settings, 'skipped_uris'):
-                    if item[-1:] == '/':
-                        item = item[:-1]
-                    skipped_urls.append(app_settings['domain'] + app_settings['path'][:-1] + item)
-                for item in _get_setting(app_settings, 'skipped_regex'):
-                    skipped_regex.append(item)
-                for item in _get_setting(app_settings, 'unprotected_uris'):
-                    if item[-1:] == '/':
-                        item = item[:-1]
-                    unprotected_urls.append(app_settings['domain'] + app_settings['path'][:-1] + item)
-                for item in _get_setting(app_settings, 'unprotected_regex'):
-                    unprotected_regex.append(item)
-                for item in _get_setting(app_settings, 'protected_uris'):
-                    if item[-1:] == '/':
-                        item = item[:-1]
-                    protected_urls.append(app_settings['domain'] + app_settings['path'][:-1] + item)
-                for item in _get_setting(app_settings, 'protected_regex'):
-                    protected_regex.append(item)
-                if 'redirected_urls' in app_settings:
-                    redirected_urls.update(app_settings['redirected_urls'])
-                if 'redirected_regex' in app_settings:
-                    redirected_regex.update(app_settings['redirected_regex'])
+    for app_id in sorted(apps_settings.keys()):
+        app_settings = apps_settings[app_id]
+        for item in _get_setting(app_settings, 'skipped_uris'):
+            if item[-1:] == '/':
+                item = item[:-1]
+            skipped_urls.append(app_settings['domain'] + app_settings['path'][:-1] + item)
+        for item in _get_setting(app_settings, 'skipped_regex'):
+            skipped_regex.append(item)
+        for item in _get_setting(app_settings, 'unprotected_uris'):
+            if item[-1:] == '/':
+                item = item[:-1]
+            unprotected_urls.append(app_settings['domain'] + app_settings['path'][:-1] + item)
+        for item in _get_setting(app_settings, 'unprotected_regex'):
+            unprotected_regex.append(item)
+        for item in _get_setting(app_settings, 'protected_uris'):
+            if item[-1:] == '/':
+                item = item[:-1]
+            protected_urls.append(app_settings['domain'] + app_settings['path'][:-1] + item)
+        for item in _get_setting(app_settings, 'protected_regex'):
+            protected_regex.append(item)
+        if 'redirected_urls' in app_settings:
+            redirected_urls.update(app_settings['redirected_urls'])
+        if 'redirected_regex' in app_settings:
+            redirected_regex.update(app_settings['redirected_regex'])
 
     for domain in domains:
         skipped_urls.extend([domain + '/yunohost/admin', domain + '/yunohost/api'])
@@ -1005,53 +1133,567 @@ def app_ssowatconf(auth):
         'redirected_regex': redirected_regex,
         'users': users,
     }
+    conf = _dump_ssowat_conf(conf_dict, mode)
 
-    with open('/etc/ssowat/conf.json', 'w+') as f:
-        json.dump(conf_dict, f, sort_keys=True, indent=4)
+    # Only write the configuration file if it has changed
+    try:
+        with open('/etc/ssowat/conf.json') as f:
+            unchanged = f.read() == conf
+    except IOError:
+        unchanged = False
+    if unchanged:
+        logger.debug("SSOwat configuration has not changed")
+    else:
+        _write_file_atomically('/etc/ssowat/conf.json', conf)
 
     logger.success(m18n.n('ssowat_conf_generated'))
 
 
-def _get_app_settings(app_id):
+def _get_apps_catalog():
     """
-    Get settings of an installed app
-
-    Keyword arguments:
-        app_id -- The app id
+    Get the compiled catalog of known apps
 
-    """
-    if not _is_installed(app_id):
-        raise MoulinetteError(errno.EINVAL,
-                              m18n.n('app_not_installed', app=app_id))
-    try:
-        with open(os.path.join(
-                apps_setting_path, app_id, 'settings.yml')) as f:
-            settings = yaml.load(f)
-        if app_id == settings['id']:
-            return settings
-    except (IOError, TypeError, KeyError):
-        logger.exception(m18n.n('app_not_correctly_installed',
-                                app=app_id))
-    return {}
+    The catalog merges the fetched apps lists - the first list defining an
+    app wins - with the manifest of installed apps which are not part of
+    them. It is compiled into apps_catalog_cache and kept in memory, and is
+    only rebuilt when an apps list or an installed app manifest changes.
 
+    Returns:
+        Dict with the 'apps' info indexed by id and their sorted 'order'
 
-def _set_app_settings(app_id, settings):
     """
-    Set settings of an app
+    global _apps_catalog
 
-    Keyword arguments:
-        app_id -- The app id
-        settings -- Dict with app settings
+    try:
+        applists = app_listlists()['lists']
+        applists[0]
+    except (IOError, IndexError):
+        app_fetchlist()
+        applists = app_listlists()['lists']
 
-    """
-    with open(os.path.join(
-            apps_setting_path, app_id, 'settings.yml'), 'w') as f:
-        yaml.safe_dump(settings, f, default_flow_style=False)
+    signature = _get_apps_catalog_signature(applists)
 
+    # Use the in-process catalog or the compiled one if still valid
+    if _apps_catalog is not None \
+            and _apps_catalog['signature'] == signature:
+        return _apps_catalog
+    try:
+        with open(apps_catalog_cache) as f:
+            catalog = json.load(f)
+    except (IOError, ValueError):
+        logger.debug("unable to load compiled apps catalog", exc_info=1)
+    else:
+        if catalog.get('signature') == signature:
+            _apps_catalog = catalog
+            return catalog
 
-def _get_app_status(app_id, format_date=False):
-    """
-    Get app status or create it if needed
+    # Compile the catalog
+    app_dict = {}
+    for applist in applists:
+        with open(os.path.join(repo_path, applist + '.json')) as json_list:
+            for app, info in json.loads(str(json_list.read())).items():
+                if app not in app_dict:
+                    info['repository'] = applist
+                    app_dict[app] = info
+
+    for app in signature['apps'].keys():
+        if app not in app_dict:
+            # Look for forks
+            if '__' in app:
+                original_app = app[:app.index('__')]
+                if original_app in app_dict:
+                    app_dict[app] = app_dict[original_app]
+                    continue
+            with open( apps_setting_path + app +'/manifest.json') as json_manifest:
+                app_dict[app] = {"manifest":json.loads(str(json_manifest.read()))}
+            app_dict[app]['repository'] = None
+
+    catalog = {
+        'signature': signature,
+        'apps': app_dict,
+        'order': sorted(app_dict.keys()),
+    }
+
+    # Store the compiled catalog
+    try:
+        _write_file_atomically(apps_catalog_cache, json.dumps(catalog))
+    except (IOError, OSError):
+        logger.warning("unable to store compiled apps catalog", exc_info=1)
+
+    _apps_catalog = catalog
+    return catalog
+
+
+def _get_apps_inventory():
+    """
+    Get a snapshot of the installed apps
+
+    The apps catalog and the status and settings of each installed app are
+    loaded once, so that a command dealing with several apps can be served
+    from it instead of calling app_info(raw=True) for each one.
+
+    Returns:
+        Dict of installed apps info - as app_info(raw=True) - indexed by id
+
+    """
+    catalog = _get_apps_catalog()['apps']
+    inventory = {}
+
+    for app_id in os.listdir(apps_setting_path):
+        info = dict(catalog[app_id])
+        info['installed'] = True
+        info['status'] = _get_app_status(app_id)
+        info['settings'] = _get_app_settings(app_id)
+        inventory[app_id] = info
+
+    return inventory
+
+
+def _get_apps_catalog_signature(applists):
+    """
+    Get what the apps catalog is compiled from
+
+    Keyword arguments:
+        applists -- The list of fetched apps lists names
+
+    Returns:
+        Dict of stat info of the apps lists and installed app manifests
+
+    """
+    signature = { 'lists': {}, 'apps': {} }
+
+    for applist in applists:
+        s = os.stat(os.path.join(repo_path, applist + '.json'))
+        signature['lists'][applist] = [s.st_mtime, s.st_size]
+
+    for app in os.listdir(apps_setting_path):
+        try:
+            s = os.stat(apps_setting_path + app + '/manifest.json')
+        except OSError:
+            signature['apps'][app] = None
+        else:
+            signature['apps'][app] = [s.st_mtime, s.st_size, s.st_ino]
+
+    # Normalize it as it would be loaded from the compiled catalog
+    return json.loads(json.dumps(signature))
+
+
+def _get_apps_locations():
+    """
+    Get the index of web locations of installed apps
+
+    Locations are indexed per domain as a tree of path segments, where each
+    node is a dict which may contain the 'app' mounted on it and its 'sub'
+    nodes by segment. The index is stored into apps_locations_cache and
+    kept in memory. It is updated by _update_app_location when the settings
+    of an app are written or when it is removed, and only built again from
+    the apps settings if the apps settings directory has been changed
+    otherwise.
+
+    Returns:
+        Dict with the 'domains' trees and the location of 'apps' by id
+
+    """
+    signature = _get_apps_instances_signature()
+    if signature is None:
+        os.makedirs(apps_setting_path)
+        signature = _get_apps_instances_signature()
+
+    if _apps_locations is not None \
+            and _apps_locations['signature'] == signature:
+        return _apps_locations
+    locations = _load_apps_locations()
+    if locations is not None and locations['signature'] == signature:
+        return locations
+
+    # Build the index from the installed apps settings
+    locations = {'signature': signature, 'apps': {}, 'domains': {}}
+    for app_id in os.listdir(apps_setting_path):
+        if not os.path.isfile(
+                os.path.join(apps_setting_path, app_id, 'settings.yml')):
+            continue
+        settings = _get_app_settings(app_id)
+        if 'domain' in settings:
+            _mount_app_location(locations, app_id, settings['domain'],
+                                settings.get('path', '/'))
+
+    _store_apps_locations(locations)
+    return locations
+
+
+def _update_app_location(app_id, settings):
+    """
+    Update the index of web locations once the settings of an app have
+    been written or once it has been removed
+
+    Keyword arguments:
+        app_id -- The app id
+        settings -- Dict with the app settings, or None if it is removed
+
+    """
+    # Start from the stored index, which may have been updated by another
+    # process - e.g. by an app script setting its domain
+    locations = _load_apps_locations()
+    if locations is None:
+        _get_apps_locations()
+        return
+
+    location = None
+    if settings is not None and 'domain' in settings:
+        location = [settings['domain'], settings.get('path', '/')]
+
+    if locations['apps'].get(app_id) != location:
+        _unmount_app_location(locations, app_id)
+        if location is not None:
+            _mount_app_location(locations, app_id, *location)
+        # Invalidate the index kept in memory by the other processes
+        os.utime(apps_setting_path, None)
+    elif locations['signature'] == _get_apps_instances_signature():
+        return
+
+    locations['signature'] = _get_apps_instances_signature()
+    _store_apps_locations(locations)
+
+
+def _load_apps_locations():
+    """Load the stored index of web locations of installed apps, or None"""
+    try:
+        with open(apps_locations_cache) as f:
+            locations = json.load(f)
+        locations['signature'], locations['apps'], locations['domains']
+    except (IOError, ValueError, KeyError, TypeError):
+        logger.debug("unable to load apps locations index", exc_info=1)
+        return None
+    return locations
+
+
+def _store_apps_locations(locations):
+    """Keep in memory and store the index of web locations of apps"""
+    global _apps_locations
+
+    _apps_locations = locations
+    try:
+        _write_file_atomically(apps_locations_cache, json.dumps(locations))
+    except (IOError, OSError):
+        logger.warning("unable to store apps locations index", exc_info=1)
+
+
+def _mount_app_location(locations, app_id, domain, path):
+    """
+    Add the location of an app to the apps locations index
+
+    Keyword arguments:
+        locations -- The apps locations index
+        app_id -- The app id
+        domain -- The domain of the app
+        path -- The path of the app
+
+    """
+    node = locations['domains'].setdefault(domain, {})
+    for segment in [s for s in path.split('/') if s]:
+        node = node.setdefault('sub', {}).setdefault(segment, {})
+    node['app'] = app_id
+    locations['apps'][app_id] = [domain, path]
+
+
+def _unmount_app_location(locations, app_id):
+    """
+    Remove the location of an app from the apps locations index
+
+    Keyword arguments:
+        locations -- The apps locations index
+        app_id -- The app id
+
+    """
+    try:
+        domain, path = locations['apps'].pop(app_id)
+        nodes = [(None, locations['domains'][domain])]
+        for segment in [s for s in path.split('/') if s]:
+            nodes.append((segment, nodes[-1][1]['sub'][segment]))
+    except KeyError:
+        return
+
+    if nodes[-1][1].get('app') == app_id:
+        del nodes[-1][1]['app']
+
+    # Prune the nodes which are now empty
+    while nodes:
+        segment, node = nodes.pop()
+        if node.get('app') or node.get('sub'):
+            break
+        if segment is None:
+            del locations['domains'][domain]
+        else:
+            del nodes[-1][1]['sub'][segment]
+            if not nodes[-1][1]['sub']:
+                del nodes[-1][1]['sub']
+
+
+def _lookup_app_location(domain, path, ignore=None):
+    """
+    Look for the apps mounted on a web location and on its parents
+
+    Keyword arguments:
+        domain -- The domain of the location
+        path -- The path of the location
+        ignore -- An app id to ignore
+
+    Returns:
+        A tuple of the app id mounted on the location and of the app id
+        and path of its nearest parent mount, each one being None if unset
+
+    """
+    node = _get_apps_locations()['domains'].get(domain)
+    segments = [s for s in path.split('/') if s]
+    parent = (None, None)
+
+    for depth in range(len(segments) + 1):
+        if node is None:
+            break
+        app_id = node.get('app')
+        if app_id is not None and app_id != ignore:
+            if depth == len(segments):
+                return (app_id, parent)
+            parent = (app_id, '/' + ''.join(s + '/' for s in segments[:depth]))
+        if depth < len(segments):
+            node = node.get('sub', {}).get(segments[depth])
+
+    return (None, parent)
+
+
+def _dump_ssowat_conf(conf_dict, mode='full'):
+    """
+    Serialize the SSOwat configuration
+
+    Keyword arguments:
+        conf_dict -- The configuration, with a map of apps for each user
+        mode -- Format of the users section, 'full' or 'compact'
+
+    """
+    if mode != 'compact':
+        return json.dumps(conf_dict, sort_keys=True, indent=4)
+
+    # Share identical users map under a common id
+    maps = {}
+    for username, user_map in conf_dict['users'].items():
+        maps[username] = json.dumps(user_map, sort_keys=True)
+    maps_ids = dict((m, str(i)) for i, m in enumerate(sorted(set(maps.values()))))
+
+    conf_dict = dict(conf_dict)
+    conf_dict['users'] = dict((u, maps_ids[m]) for u, m in maps.items())
+    conf_dict['users_maps'] = dict((i, json.loads(m)) for m, i in maps_ids.items())
+
+    return json.dumps(conf_dict, sort_keys=True, separators=(',', ':'))
+
+
+def _get_apps_access_index(apps_settings):
+    """
+    Index the web access rules of installed apps
+
+    Keyword arguments:
+        apps_settings -- Dict of installed apps settings indexed by id
+
+    Returns:
+        A tuple of the apps map - as app_map() - allowed to everyone and a
+        dict of the private apps map indexed by allowed user
+
+    """
+    public_map = {}
+    private_maps = {}
+
+    for app_id in sorted(apps_settings.keys()):
+        app_settings = apps_settings[app_id]
+        if 'domain' not in app_settings:
+            continue
+        url = app_settings['domain'] + app_settings.get('path', '/')
+
+        if app_settings.get('mode', 'private') == 'private' \
+                and 'allowed_users' in app_settings:
+            for user in app_settings['allowed_users'].split(','):
+                if user not in private_maps:
+                    private_maps[user] = {}
+                private_maps[user][url] = app_settings['label']
+        else:
+            public_map[url] = app_settings['label']
+
+    return public_map, private_maps
+
+
+def _get_app_settings(app_id):
+    """
+    Get settings of an installed app
+
+    Settings are cached for the process lifetime and only loaded again if
+    the stat info of the file has changed.
+
+    Keyword arguments:
+        app_id -- The app id
+
+    """
+    if not _is_installed(app_id):
+        raise MoulinetteError(errno.EINVAL,
+                              m18n.n('app_not_installed', app=app_id))
+    settings_file = os.path.join(apps_setting_path, app_id, 'settings.yml')
+    try:
+        s = os.stat(settings_file)
+        key = (s.st_mtime, s.st_size, s.st_ino)
+        try:
+            cached_key, settings = _apps_settings_cache[settings_file]
+        except KeyError:
+            cached_key = None
+        if cached_key != key:
+            with open(settings_file) as f:
+                settings = yaml.load(f, Loader=_yaml_loader)
+            _apps_settings_cache[settings_file] = (key, settings)
+        if app_id == settings['id']:
+            return copy.deepcopy(settings)
+    except (IOError, OSError, TypeError, KeyError):
+        logger.exception(m18n.n('app_not_correctly_installed',
+                                app=app_id))
+    return {}
+
+
+def _set_app_settings(app_id, settings):
+    """
+    Set settings of an app
+
+    The settings file is atomically replaced - keeping its permissions -
+    and the settings cache and the apps locations index are updated.
+
+    Keyword arguments:
+        app_id -- The app id
+        settings -- Dict with app settings
+
+    """
+    settings_file = os.path.join(apps_setting_path, app_id, 'settings.yml')
+    try:
+        mode = stat.S_IMODE(os.stat(settings_file).st_mode)
+    except OSError:
+        mode = 0644
+
+    _write_file_atomically(settings_file,
+        yaml.safe_dump(settings, default_flow_style=False), mode)
+
+    s = os.stat(settings_file)
+    _apps_settings_cache[settings_file] = (
+        (s.st_mtime, s.st_size, s.st_ino), copy.deepcopy(settings))
+    _update_app_location(app_id, settings)
+
+
+def _apply_access_changes(auth, changes):
+    """
+    Apply access rights changes to apps
+
+    The settings of each changed app are written once, then the hooks of
+    each change are called and the SSOwat configuration is regenerated.
+
+    Keyword arguments:
+        changes -- List of (action, apps, users) tuples, action being one
+            of 'add', 'remove' or 'clear' and users being None to grant or
+            revoke everyone
+
+    Returns:
+        Dict of the resulting set of allowed users, indexed by app id, for
+        the apps which have been granted or revoked access
+
+    """
+    from yunohost.user import user_list, _get_existing_users
+    from yunohost.hook import hook_callback
+
+    apps_settings = {}
+    changed_apps = []
+    hooks = []
+    result = {}
+    all_users = None
+
+    # Look for all the users to grant at once
+    users_to_add = set()
+    for action, apps, users in changes:
+        if action == 'add' and users:
+            users_to_add.update(users)
+    existing_users = _get_existing_users(auth, users_to_add) \
+        if users_to_add else set()
+
+    for action, apps, users in changes:
+        if action != 'clear' and users is None and all_users is None:
+            all_users = user_list(auth)['users'].keys()
+
+        for app in apps:
+            if app not in apps_settings:
+                apps_settings[app] = _get_app_settings(app)
+            app_settings = apps_settings[app]
+            if not app_settings:
+                continue
+
+            if action == 'add':
+                if 'mode' not in app_settings:
+                    app_settings['mode'] = 'private'
+                    if app not in changed_apps:
+                        changed_apps.append(app)
+                if app_settings['mode'] != 'private':
+                    continue
+
+                allowed_users = set()
+                if 'allowed_users' in app_settings:
+                    allowed_users = set(app_settings['allowed_users'].split(','))
+
+                for allowed_user in users or all_users:
+                    if allowed_user not in allowed_users:
+                        if users is not None \
+                                and allowed_user not in existing_users:
+                            logger.warning(m18n.n('user_unknown',
+                                                  user=allowed_user))
+                            continue
+                        allowed_users.add(allowed_user)
+
+                new_users = ','.join(allowed_users)
+                app_settings['allowed_users'] = new_users
+                hooks.append(('post_app_addaccess', [app, new_users]))
+                result[app] = allowed_users
+            elif action == 'remove':
+                if app_settings.get('skipped_uris', '') == '/':
+                    continue
+
+                allowed_users = set()
+                if users is None:
+                    pass
+                elif 'allowed_users' in app_settings:
+                    for allowed_user in app_settings['allowed_users'].split(','):
+                        if allowed_user not in users:
+                            allowed_users.add(allowed_user)
+                else:
+                    if all_users is None:
+                        all_users = user_list(auth)['users'].keys()
+                    for allowed_user in all_users:
+                        if allowed_user not in users:
+                            allowed_users.add(allowed_user)
+
+                new_users = ','.join(allowed_users)
+                app_settings['allowed_users'] = new_users
+                hooks.append(('post_app_removeaccess', [app, new_users]))
+                result[app] = allowed_users
+            else:
+                app_settings.pop('mode', None)
+                app_settings.pop('allowed_users', None)
+                hooks.append(('post_app_clearaccess', [app]))
+                result.pop(app, None)
+
+            if app not in changed_apps:
+                changed_apps.append(app)
+
+    for app in changed_apps:
+        _set_app_settings(app, apps_settings[app])
+    for hook, args in hooks:
+        hook_callback(hook, args=args)
+
+    app_ssowatconf(auth)
+
+    return result
+
+
+def _get_app_status(app_id, format_date=False):
+    """
+    Get app status or create it if needed
 
     Keyword arguments:
         app_id -- The app id
@@ -1089,49 +1731,324 @@ def _get_app_status(app_id, format_date=False):
     return status
 
 
-def _extract_app_from_file(path, remove=False):
+def _make_work_dir(prefix):
+    """
+    Create a unique working folder for apps sources
+
+    The folder is owned by admin since app scripts are executed as this
+    user from the sources, and may access their parent folders.
+
+    Keyword arguments:
+        prefix -- Prefix of the folder name
+
+    Returns:
+        Path of the folder
+
+    """
+    try: os.listdir(install_tmp)
+    except OSError: os.makedirs(install_tmp)
+    work_dir = tempfile.mkdtemp(prefix=prefix, dir=install_tmp)
+    admin = pwd.getpwnam('admin')
+    os.chown(work_dir, admin.pw_uid, admin.pw_gid)
+    os.chmod(work_dir, 0755)
+    return work_dir
+
+
+def _fetch_app_sources(app, folder=app_tmp_folder):
+    """
+    Fetch or extract the sources of an app to install into a folder
+
+    Keyword arguments:
+        app -- Name, local path or git URL of the app
+        folder -- The folder to fetch the sources to
+
+    Returns:
+        Dict manifest
+
+    """
+    if app in _get_apps_catalog()['apps'] or ('@' in app) \
+            or ('http://' in app) or ('https://' in app):
+        return _fetch_app_from_git(app, folder=folder)
+    elif os.path.exists(app):
+        return _extract_app_from_file(app, folder=folder)
+    raise MoulinetteError(errno.EINVAL, m18n.n('app_unknown'))
+
+
+def _get_app_instance_id(manifest, pending_apps=[]):
     """
-    Unzip or untar application tarball in app_tmp_folder, or copy it from a directory
+    Get the id of a new instance of an app
+
+    Keyword arguments:
+        manifest -- The app manifest
+        pending_apps -- Ids of apps which are about to be installed
+
+    Returns:
+        The app id, suffixed with its instance number if it is forked
+
+    """
+    # Check ID
+    if 'id' not in manifest or '__' in manifest['id']:
+        raise MoulinetteError(errno.EINVAL, m18n.n('app_id_invalid'))
+
+    app_id = manifest['id']
+
+    # Check if app can be forked
+    instance_number = _installed_instance_number(app_id, last=True)
+    for pending_app in pending_apps:
+        if pending_app == app_id:
+            instance_number = max(instance_number, 1)
+        elif pending_app.startswith(app_id + '__'):
+            instance_number = max(instance_number,
+                                  int(pending_app[len(app_id) + 2:]))
+    instance_number += 1
+
+    if instance_number > 1 :
+        if 'multi_instance' not in manifest or not is_true(manifest['multi_instance']):
+            raise MoulinetteError(errno.EEXIST,
+                                  m18n.n('app_already_installed', app=app_id))
+
+        # Change app_id to the forked app id
+        app_id = app_id + '__' + str(instance_number)
+
+        # Never reuse the id of an installed app, even if the index is stale
+        while _is_installed(app_id):
+            instance_number += 1
+            app_id = manifest['id'] + '__' + str(instance_number)
+
+    return app_id
+
+
+def _install_app(app_id, manifest, folder, label=None, args_list=[]):
+    """
+    Install an app from its fetched sources
+
+    The sources folder is removed once done.
+
+    Keyword arguments:
+        app_id -- The id of the app instance to install
+        manifest -- The app manifest
+        folder -- The folder of the app sources
+        label -- Custom name for the app
+        args_list -- Arguments list for the install script
+
+    """
+    from yunohost.hook import hook_add, hook_remove, hook_exec
+
+    status = {
+        'installed_at': int(time.time()),
+        'upgraded_at': None,
+        'remote': manifest.get('remote', {}),
+    }
+
+    # Create app directory
+    app_setting_path = os.path.join(apps_setting_path, app_id)
+    if os.path.exists(app_setting_path):
+        shutil.rmtree(app_setting_path)
+    os.makedirs(app_setting_path)
+    _update_apps_instances(app_id, True)
+
+    # Clean hooks and add new ones
+    hook_remove(app_id)
+    if 'hooks' in os.listdir(folder):
+        for file in os.listdir(folder +'/hooks'):
+            hook_add(app_id, folder +'/hooks/'+ file)
+
+    # Set initial app settings
+    app_settings = {
+        'id': app_id,
+        'label': label if label else manifest['name'],
+    }
+    # TODO: Move install_time away from app settings
+    app_settings['install_time'] = status['installed_at']
+    _set_app_settings(app_id, app_settings)
+
+    # Move scripts and manifest to the right place
+    shutil.copy(os.path.join(folder, 'manifest.json'), app_setting_path)
+    shutil.copytree(os.path.join(folder, 'scripts'),
+                    os.path.join(app_setting_path, 'scripts'))
+
+    # Execute the app install script
+    install_retcode = 1
+    try:
+        install_retcode = hook_exec(
+            os.path.join(folder, 'scripts/install'), args_list)
+    except (KeyboardInterrupt, EOFError):
+        install_retcode = -1
+    except:
+        logger.exception(m18n.n('unexpected_error'))
+    finally:
+        if install_retcode != 0:
+            # Execute remove script
+            remove_retcode = hook_exec(
+                os.path.join(folder, 'scripts/remove'), [app_id])
+            if remove_retcode != 0:
+                logger.warning(m18n.n('app_not_properly_removed', app=app_id))
+
+            # Clean tmp folders
+            hook_remove(app_id)
+            shutil.rmtree(app_setting_path)
+            _update_app_location(app_id, None)
+            _update_apps_instances(app_id, False)
+            shutil.rmtree(folder)
+
+            if install_retcode == -1:
+                raise MoulinetteError(errno.EINTR,
+                                      m18n.g('operation_interrupted'))
+            raise MoulinetteError(errno.EIO, m18n.n('installation_failed'))
+
+    # Store app status
+    with open(app_setting_path + '/status.json', 'w+') as f:
+        json.dump(status, f)
+
+    # Clean and set permissions
+    shutil.rmtree(folder)
+    apply_permissions(app_setting_path, [
+        ('*', 'root', 0400),
+        ('scripts', 'admin', None),
+        ('scripts/*', 'admin', None),
+    ])
+
+
+def _install_app_in_thread(results, index, *args):
+    """
+    Install an app from a worker thread
+
+    The (index, error) tuple is put into the results queue once done, the
+    error being None on success.
+
+    """
+    try:
+        _install_app(*args)
+    except Exception as e:
+        logger.debug("unable to install app #%d", index, exc_info=1)
+        results.put((index, e))
+    else:
+        results.put((index, None))
+
+
+def _parse_apps_install_list(apps):
+    """
+    Parse the list of apps to install at once
+
+    Keyword arguments:
+        apps -- YAML or JSON list of apps, or path of a file containing it
+
+    Returns:
+        List of dict with the 'app', its 'label' and its 'args' dict
+
+    """
+    try:
+        if os.path.isfile(apps):
+            with open(apps) as f:
+                apps = f.read()
+        apps = yaml.load(apps, Loader=_yaml_loader)
+    except (IOError, yaml.YAMLError) as e:
+        raise MoulinetteError(errno.EINVAL,
+            m18n.n('app_install_list_invalid', error=str(e)))
+
+    entries = []
+    for entry in apps if isinstance(apps, list) and apps else [None]:
+        if isinstance(entry, basestring):
+            entry = {'app': entry}
+        if not isinstance(entry, dict) or not entry.get('app'):
+            raise MoulinetteError(errno.EINVAL,
+                m18n.n('app_install_list_invalid', error=json.dumps(entry)))
+        args = entry.get('args') or {}
+        if not isinstance(args, dict):
+            args = dict(urlparse.parse_qsl(str(args), keep_blank_values=True))
+        entries.append({
+            'app': str(entry['app']),
+            'label': entry.get('label'),
+            'args': dict((str(k), str(v)) for k, v in args.items()),
+        })
+    return entries
+
+
+def _sort_apps_install_list(entries, manifests, app_ids):
+    """
+    Sort apps to install according to the dependencies between them
+
+    An app depends on another one of the list if the latter is given as one
+    of its app arguments.
+
+    Keyword arguments:
+        entries -- The parsed list of apps to install
+        manifests -- The manifest of each app
+        app_ids -- The allocated id of each app
+
+    Returns:
+        A tuple of the sorted list of indexes and of the dict of set of
+        indexes each app depends on
+
+    """
+    dependencies = {}
+    for i, manifest in enumerate(manifests):
+        dependencies[i] = set()
+        for arg in manifest.get('arguments', {}).get('install', []):
+            if arg.get('type') == 'app':
+                value = entries[i]['args'].get(arg['name'], arg.get('default'))
+                if value in app_ids and app_ids.index(value) != i:
+                    dependencies[i].add(app_ids.index(value))
+
+    order = []
+    while len(order) < len(manifests):
+        ready = [i for i in range(len(manifests))
+                 if i not in order and dependencies[i].issubset(order)]
+        if not ready:
+            raise MoulinetteError(errno.EINVAL,
+                m18n.n('app_install_list_invalid', error='dependency cycle'))
+        order.extend(ready)
+    return (order, dependencies)
+
+
+def _extract_app_from_file(path, remove=False, folder=app_tmp_folder):
+    """
+    Unzip or untar application tarball in a folder, or copy it from a directory
+
+    If the sources are contained in a single directory, its content is moved
+    to the folder root.
 
     Keyword arguments:
         path -- Path of the tarball or directory
         remove -- Remove the tarball after extraction
+        folder -- The folder to extract the sources to
 
     Returns:
         Dict manifest
 
     """
-    global app_tmp_folder
-
     logger.info(m18n.n('extracting'))
 
-    if os.path.exists(app_tmp_folder): shutil.rmtree(app_tmp_folder)
-    os.makedirs(app_tmp_folder)
+    if os.path.exists(folder): shutil.rmtree(folder)
 
     path = os.path.abspath(path)
 
-    if ".zip" in path:
-        extract_result = os.system('unzip %s -d %s > /dev/null 2>&1' % (path, app_tmp_folder))
-        if remove: os.remove(path)
-    elif ".tar" in path:
-        extract_result = os.system('tar -xf %s -C %s > /dev/null 2>&1' % (path, app_tmp_folder))
-        if remove: os.remove(path)
-    elif os.path.isdir(path):
-        shutil.rmtree(app_tmp_folder)
-        if path[len(path)-1:] != '/':
-            path = path + '/'
-        extract_result = os.system('cp -a "%s" %s' % (path, app_tmp_folder))
+    # Give the sources to the admin user while extracting them
+    try:
+        owner = pwd.getpwnam('admin')
+    except KeyError:
+        uid = gid = None
     else:
-        extract_result = 1
+        uid, gid = owner.pw_uid, owner.pw_gid
 
-    if extract_result != 0:
+    try:
+        extract_archive(path, folder, uid, gid)
+    except (ArchiveError, IOError, OSError):
+        logger.debug("unable to extract '%s'", path, exc_info=1)
         raise MoulinetteError(errno.EINVAL, m18n.n('app_extraction_failed'))
+    finally:
+        if remove and os.path.isfile(path):
+            os.remove(path)
 
     try:
-        if len(os.listdir(app_tmp_folder)) == 1:
-            for folder in os.listdir(app_tmp_folder):
-                app_tmp_folder = app_tmp_folder +'/'+ folder
-        with open(app_tmp_folder + '/manifest.json') as json_manifest:
+        content = os.listdir(folder)
+        if len(content) == 1 and os.path.isdir(os.path.join(folder, content[0])):
+            if os.path.exists(folder + '.tmp'):
+                shutil.rmtree(folder + '.tmp')
+            os.rename(os.path.join(folder, content[0]), folder + '.tmp')
+            os.rmdir(folder)
+            os.rename(folder + '.tmp', folder)
+        with open(folder + '/manifest.json') as json_manifest:
             manifest = json.loads(str(json_manifest.read()))
             manifest['lastUpdate'] = int(time.time())
     except IOError:
@@ -1143,6 +2060,29 @@ def _extract_app_from_file(path, remove=False):
     return manifest
 
 
+def _write_file_atomically(path, content, mode=0644):
+    """
+    Write a file through a temporary one which is renamed to it
+
+    Keyword arguments:
+        path -- The path of the file to write
+        content -- The string to write
+        mode -- The permissions of the file
+
+    """
+    dirname, basename = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % basename, dir=dirname)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.chmod(tmp_path, mode)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def _get_git_last_commit_hash(repository, reference='HEAD'):
     """
     Attempt to retrieve the last commit hash of a git repository
@@ -1163,25 +2103,27 @@ def _get_git_last_commit_hash(repository, reference='HEAD'):
         return commit.strip()
 
 
-def _fetch_app_from_git(app):
+def _fetch_app_from_git(app, folder=app_tmp_folder):
     """
-    Unzip or untar application tarball in app_tmp_folder
+    Fetch application sources from git into a folder
+
+    Sources are taken from the local sources cache if they have already
+    been fetched for the same revision, and stored into it otherwise.
 
     Keyword arguments:
         app -- App_id or git repo URL
+        folder -- The folder to fetch the sources to
 
     Returns:
         Dict manifest
 
     """
-    app_tmp_archive = '{0}.zip'.format(app_tmp_folder)
-    if os.path.exists(app_tmp_folder):
-        shutil.rmtree(app_tmp_folder)
+    app_tmp_archive = '{0}.zip'.format(folder)
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
     if os.path.exists(app_tmp_archive):
         os.remove(app_tmp_archive)
 
-    logger.info(m18n.n('downloading'))
-
     if ('@' in app) or ('http://' in app) or ('https://' in app):
         url = app
         branch = 'master'
@@ -1193,6 +2135,22 @@ def _fetch_app_from_git(app):
                 owner=github_repo.group('owner'),
                 repo=github_repo.group('repo'),
             )
+        else:
+            tree_index = url.rfind('/tree/')
+            if tree_index > 0:
+                url = url[:tree_index]
+                branch = app[tree_index+6:]
+
+        try:
+            revision = _get_git_last_commit_hash(url, branch)
+        except:
+            revision = None
+
+        cached_sources = _get_cached_app_sources(url, revision)
+        if cached_sources:
+            manifest = _extract_app_from_file(cached_sources, folder=folder)
+        elif github_repo:
+            logger.info(m18n.n('downloading'))
             tarball_url = "{url}/archive/{tree}.zip".format(
                 url=url, tree=branch
             )
@@ -1204,20 +2162,18 @@ def _fetch_app_from_git(app):
                 raise MoulinetteError(errno.EIO,
                                       m18n.n('app_sources_fetch_failed'))
             else:
+                archive = _cache_app_sources(url, revision, app_tmp_archive)
                 manifest = _extract_app_from_file(
-                    app_tmp_archive, remove=True)
+                    archive, remove=(archive == app_tmp_archive), folder=folder)
         else:
-            tree_index = url.rfind('/tree/')
-            if tree_index > 0:
-                url = url[:tree_index]
-                branch = app[tree_index+6:]
+            logger.info(m18n.n('downloading'))
             try:
                 subprocess.check_call([
-                    'git', 'clone', '--depth=1', url, app_tmp_folder])
+                    'git', 'clone', '--depth=1', url, folder])
                 subprocess.check_call([
                         'git', 'reset', '--hard', branch
-                    ], cwd=app_tmp_folder)
-                with open(app_tmp_folder + '/manifest.json') as f:
+                    ], cwd=folder)
+                with open(folder + '/manifest.json') as f:
                     manifest = json.loads(str(f.read()))
             except subprocess.CalledProcessError:
                 raise MoulinetteError(errno.EIO,
@@ -1226,22 +2182,22 @@ def _fetch_app_from_git(app):
                 raise MoulinetteError(errno.EIO,
                                       m18n.n('app_manifest_invalid'))
             else:
+                _cache_app_sources(url, revision, folder)
+                # Cloned sources are not extracted, give them to admin
+                os.system('chown -hR admin: %s' % folder)
                 logger.info(m18n.n('done'))
 
         # Store remote repository info into the returned manifest
         manifest['remote'] = {'type': 'git', 'url': url, 'branch': branch}
-        try:
-            revision = _get_git_last_commit_hash(url, branch)
-        except: pass
-        else:
+        if revision:
             manifest['remote']['revision'] = revision
     else:
-        app_dict = app_list(raw=True)
+        app_dict = _get_apps_catalog()['apps']
 
         if app in app_dict:
             app_info = app_dict[app]
-            app_info['manifest']['lastUpdate'] = app_info['lastUpdate']
-            manifest = app_info['manifest']
+            manifest = dict(app_info['manifest'])
+            manifest['lastUpdate'] = app_info['lastUpdate']
         else:
             raise MoulinetteError(errno.EINVAL, m18n.n('app_unknown'))
 
@@ -1249,8 +2205,13 @@ def _fetch_app_from_git(app):
             raise MoulinetteError(errno.EINVAL,
                                   m18n.n('app_unsupported_remote_type'))
         url = app_info['git']['url']
+        revision = str(app_info['git']['revision'])
 
-        if 'github.com' in url:
+        cached_sources = _get_cached_app_sources(url, revision)
+        if cached_sources:
+            manifest = _extract_app_from_file(cached_sources, folder=folder)
+        elif 'github.com' in url:
+            logger.info(m18n.n('downloading'))
             tarball_url = "{url}/archive/{tree}.zip".format(
                 url=url, tree=app_info['git']['revision']
             )
@@ -1262,18 +2223,19 @@ def _fetch_app_from_git(app):
                 raise MoulinetteError(errno.EIO,
                                       m18n.n('app_sources_fetch_failed'))
             else:
+                archive = _cache_app_sources(url, revision, app_tmp_archive)
                 manifest = _extract_app_from_file(
-                    app_tmp_archive, remove=True)
+                    archive, remove=(archive == app_tmp_archive), folder=folder)
         else:
+            logger.info(m18n.n('downloading'))
             try:
                 subprocess.check_call([
                     'git', 'clone', app_info['git']['url'],
-                    '-b', app_info['git']['branch'], app_tmp_folder])
+                    '-b', app_info['git']['branch'], folder])
                 subprocess.check_call([
-                        'git', 'reset', '--hard',
-                        str(app_info['git']['revision'])
-                    ], cwd=app_tmp_folder)
-                with open(app_tmp_folder + '/manifest.json') as f:
+                        'git', 'reset', '--hard', revision
+                    ], cwd=folder)
+                with open(folder + '/manifest.json') as f:
                     manifest = json.loads(str(f.read()))
             except subprocess.CalledProcessError:
                 raise MoulinetteError(errno.EIO,
@@ -1282,6 +2244,9 @@ def _fetch_app_from_git(app):
                 raise MoulinetteError(errno.EIO,
                                       m18n.n('app_manifest_invalid'))
             else:
+                _cache_app_sources(url, revision, folder)
+                # Cloned sources are not extracted, give them to admin
+                os.system('chown -hR admin: %s' % folder)
                 logger.info(m18n.n('done'))
 
         # Store remote repository info into the returned manifest
@@ -1295,6 +2260,101 @@ def _fetch_app_from_git(app):
     return manifest
 
 
+def _get_cached_app_sources(url, revision):
+    """
+    Get the cached sources archive of an app
+
+    Keyword arguments:
+        url -- The git repository URL of the app
+        revision -- The revision of the sources
+
+    Returns:
+        The path of the cached archive or None if it is not cached
+
+    """
+    if not revision:
+        return None
+
+    key = hashlib.sha1('{0}@{1}'.format(url, revision)).hexdigest()
+    for ext in ['.zip', '.tar']:
+        path = os.path.join(app_sources_cache, key + ext)
+        if os.path.isfile(path):
+            logger.debug("using cached sources of %s at %s", url, revision)
+            # Mark it as recently used
+            os.utime(path, None)
+            return path
+    return None
+
+
+def _cache_app_sources(url, revision, path):
+    """
+    Store the sources of an app into the sources cache
+
+    The least recently used archives are evicted from the cache so that it
+    does not exceed app_sources_cache_size.
+
+    Keyword arguments:
+        url -- The git repository URL of the app
+        revision -- The revision of the sources
+        path -- A zip archive - which is moved - or a directory - which is
+            archived without its git data - of the sources
+
+    Returns:
+        The path of the cached archive, or the given one if the sources could
+        not be cached
+
+    """
+    if not revision:
+        return path
+
+    key = hashlib.sha1('{0}@{1}'.format(url, revision)).hexdigest()
+    try:
+        if not os.path.isdir(app_sources_cache):
+            os.makedirs(app_sources_cache, 0700)
+
+        if os.path.isdir(path):
+            cached_path = os.path.join(app_sources_cache, key + '.tar')
+            fd, tmp_path = tempfile.mkstemp(
+                prefix=key, suffix='.tmp', dir=app_sources_cache)
+            os.close(fd)
+            with tarfile.open(tmp_path, 'w') as tar:
+                for name in os.listdir(path):
+                    if name != '.git':
+                        tar.add(os.path.join(path, name), arcname=name)
+            os.rename(tmp_path, cached_path)
+        else:
+            cached_path = os.path.join(app_sources_cache, key + '.zip')
+            shutil.move(path, cached_path)
+    except (IOError, OSError, tarfile.TarError):
+        logger.warning("unable to cache sources of %s", url, exc_info=1)
+        return path
+
+    # Evict least recently used archives
+    archives = []
+    for name in os.listdir(app_sources_cache):
+        if name.endswith('.tmp'):
+            continue
+        try:
+            s = os.stat(os.path.join(app_sources_cache, name))
+        except OSError:
+            continue
+        archives.append((s.st_mtime, s.st_size, name))
+    cache_size = sum(a[1] for a in archives)
+    for mtime, size, name in sorted(archives):
+        if cache_size <= app_sources_cache_size:
+            break
+        if name == os.path.basename(cached_path):
+            continue
+        logger.debug("evicting cached sources '%s'", name)
+        try:
+            os.remove(os.path.join(app_sources_cache, name))
+        except OSError:
+            pass
+        cache_size -= size
+
+    return cached_path
+
+
 def _installed_instance_number(app, last=False):
     """
     Check if application is installed and return instance number
@@ -1307,32 +2367,113 @@ def _installed_instance_number(app, last=False):
         Number of last installed instance | List or instances
 
     """
+    numbers = _get_apps_instances().get(app, [])
     if last:
-        number = 0
-        try:
-            installed_apps = os.listdir(apps_setting_path)
-        except OSError:
+        return numbers[-1] if numbers else 0
+    return list(numbers)
+
+
+def _get_apps_instances():
+    """
+    Get the index of installed instances of each app
+
+    The index is stored into apps_instances_cache and kept in memory. It
+    is updated by _update_apps_instances on install and remove, and only
+    built again from the apps settings directory listing if the latter
+    has been changed otherwise.
+
+    Returns:
+        Dict of the sorted list of instance numbers indexed by app id
+
+    """
+    global _apps_instances
+
+    with _apps_instances_lock:
+        signature = _get_apps_instances_signature()
+        if signature is None:
             os.makedirs(apps_setting_path)
-            return 0
+            signature = _get_apps_instances_signature()
 
-        for installed_app in installed_apps:
-            if number == 0 and app == installed_app:
-                number = 1
-            elif '__' in installed_app:
-                if app == installed_app[:installed_app.index('__')]:
-                    if int(installed_app[installed_app.index('__') + 2:]) > number:
-                        number = int(installed_app[installed_app.index('__') + 2:])
+        if _apps_instances is not None \
+                and _apps_instances['signature'] == signature:
+            return _apps_instances['apps']
+        try:
+            with open(apps_instances_cache) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            logger.debug("unable to load apps instances index", exc_info=1)
+        else:
+            if isinstance(index, dict) and index.get('signature') == signature:
+                _apps_instances = index
+                return index['apps']
+
+        # Build the index from the installed apps
+        apps = {}
+        for installed_app in os.listdir(apps_setting_path):
+            app_id, _, number = installed_app.partition('__')
+            try:
+                apps.setdefault(app_id, []).append(int(number or 1))
+            except ValueError:
+                continue
+        for numbers in apps.values():
+            numbers.sort()
 
-        return number
+        _store_apps_instances({'signature': signature, 'apps': apps})
+        return apps
 
-    else:
-        instance_number_list = []
-        instances_dict = app_map(app=app, raw=True)
-        for key, domain in instances_dict.items():
-            for key, path in domain.items():
-                instance_number_list.append(path['instance'])
 
-        return sorted(instance_number_list)
+def _update_apps_instances(app, installed):
+    """
+    Update the index of installed instances once an app has been installed
+    or removed
+
+    Keyword arguments:
+        app -- The app instance id
+        installed -- Whether the app has been installed or removed
+
+    """
+    app_id, _, number = app.partition('__')
+    number = int(number or 1)
+
+    with _apps_instances_lock:
+        if _apps_instances is None:
+            _get_apps_instances()
+            return
+
+        numbers = _apps_instances['apps'].setdefault(app_id, [])
+        if installed and number not in numbers:
+            numbers.append(number)
+            numbers.sort()
+        elif not installed and number in numbers:
+            numbers.remove(number)
+        if not numbers:
+            del _apps_instances['apps'][app_id]
+
+        _store_apps_instances({
+            'signature': _get_apps_instances_signature(),
+            'apps': _apps_instances['apps'],
+        })
+
+
+def _get_apps_instances_signature():
+    """Get the stat info of the apps settings directory, or None"""
+    try:
+        s = os.stat(apps_setting_path)
+    except OSError:
+        return None
+    # Normalize it as it would be loaded from the stored index
+    return [s.st_mtime, s.st_ino]
+
+
+def _store_apps_instances(index):
+    """Keep in memory and store the index of installed apps instances"""
+    global _apps_instances
+
+    _apps_instances = index
+    try:
+        _write_file_atomically(apps_instances_cache, json.dumps(index))
+    except (IOError, OSError):
+        logger.warning("unable to store apps instances index", exc_info=1)
 
 
 def _is_installed(app):
@@ -1412,7 +2553,8 @@ def _check_manifest_requirements(manifest):
                                      pkgname=pkgname, version=version,
                                      spec=spec))
 
-def _parse_args_from_manifest(manifest, action, args={}, auth=None):
+def _parse_args_from_manifest(manifest, action, args={}, auth=None,
+                              pending_apps=[], context=None):
     """Parse arguments needed for an action from the manifest
 
     Retrieve specified arguments for the action from the manifest, and parse
@@ -1425,10 +2567,12 @@ def _parse_args_from_manifest(manifest, action, args={}, auth=None):
         manifest -- The app manifest to use
         action -- The action to retrieve arguments for
         args -- A dictionnary of arguments to parse
+        pending_apps -- Ids of apps which are about to be installed
+        context -- The _LookupContext to use, a new one by default
 
     """
-    from yunohost.domain import domain_list
-    from yunohost.user import user_info
+    if context is None:
+        context = _LookupContext(auth)
 
     args_list = []
     try:
@@ -1490,19 +2634,18 @@ def _parse_args_from_manifest(manifest, action, args={}, auth=None):
 
             # Validate argument type
             if arg_type == 'domain':
-                if arg_value not in domain_list(auth)['domains']:
+                if arg_value not in context.domains:
                     raise MoulinetteError(errno.EINVAL,
                         m18n.n('app_argument_invalid',
                             name=arg_name, error=m18n.n('domain_unknown')))
             elif arg_type == 'user':
-                try:
-                    user_info(auth, arg_value)
-                except MoulinetteError as e:
+                if not context.user_exists(arg_value):
                     raise MoulinetteError(errno.EINVAL,
-                        m18n.n('app_argument_invalid',
-                            name=arg_name, error=e.strerror))
+                        m18n.n('app_argument_invalid', name=arg_name,
+                            error=m18n.n('user_unknown', user=arg_value)))
             elif arg_type == 'app':
-                if not _is_installed(arg_value):
+                if arg_value not in context.installed_apps \
+                        and arg_value not in pending_apps:
                     raise MoulinetteError(errno.EINVAL,
                         m18n.n('app_argument_invalid',
                             name=arg_name, error=m18n.n('app_unknown')))
@@ -1522,6 +2665,47 @@ def _parse_args_from_manifest(manifest, action, args={}, auth=None):
     return args_list
 
 
+class _LookupContext(object):
+    """Memoize the lookups done while processing a command
+
+    Domains and installed apps are each retrieved once on first access,
+    with a single LDAP search for domains, and kept as sets for the context
+    lifetime. Users - by username or mail - are looked for one at a time
+    when needed, and the result is kept for the context lifetime.
+
+    """
+
+    def __init__(self, auth):
+        self.auth = auth
+        self._domains = None
+        self._users = {}
+        self._installed_apps = None
+
+    @property
+    def domains(self):
+        if self._domains is None:
+            from yunohost.domain import domain_list
+            self._domains = set(domain_list(self.auth)['domains'])
+        return self._domains
+
+    def user_exists(self, name):
+        """Return whether a user exists with the given username or mail"""
+        name = name.lower()
+        if name not in self._users:
+            from yunohost.user import _get_existing_users
+            self._users[name] = bool(_get_existing_users(self.auth, [name]))
+        return self._users[name]
+
+    @property
+    def installed_apps(self):
+        if self._installed_apps is None:
+            try:
+                self._installed_apps = set(os.listdir(apps_setting_path))
+            except OSError:
+                self._installed_apps = set()
+        return self._installed_apps
+
+
 def is_true(arg):
     """
     Convert a string into a boolean
@@ -26,35 +26,62 @@
 import os
 import re
 import sys
+import csv
+import pwd
 import json
+import stat
 import errno
 import time
+import gzip
 import tarfile
 import shutil
 import subprocess
 from glob import glob
+from StringIO import StringIO
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 from moulinette.core import MoulinetteError
 from moulinette.utils import filesystem
 from moulinette.utils.log import getActionLogger
 
-from yunohost.app import app_info, app_ssowatconf, _is_installed,
+from yunohost.app import app_info, app_ssowatconf, is_true, _is_installed
 from yunohost.hook import (
     hook_info, hook_callback, hook_exec, custom_hook_folder
 )
 from yunohost.monitor import binary_to_human
 from yunohost.tools import tools_postinstall
+from yunohost.utils.chunkstore import (
+    ChunkStore, ChunkStoreError, build_index, extract_index, get_index_chunks
+)
+from yunohost.utils.archive import (
+    ArchiveError, IndexedTarFile, extract_tar_members, with_link_targets
+)
+from yunohost.utils.compression import (
+    CODECS, CodecError, benchmark_codec, get_codec, get_codec_from_filename,
+    open_compressed_reader, open_compressed_writer
+)
+from yunohost.utils.permissions import apply_permissions
 
 backup_path   = '/home/yunohost.backup'
 archives_path = '%s/archives' % backup_path
+chunks_path   = '%s/chunks' % backup_path
 
 logger = getActionLogger('yunohost.backup')
 
 
 def backup_create(name=None, description=None, output_directory=None,
                   no_compress=False, ignore_hooks=False, hooks=[],
-                  ignore_apps=False, apps=[]):
+                  ignore_apps=False, apps=[], compress_jobs=None,
+                  incremental=False, jobs=1, progress_callback=None,
+                  compression='gzip', compression_level=None):
     """
     Create a backup local archive
 
@@ -67,6 +94,15 @@ def backup_create(name=None, description=None, output_directory=None,
         ignore_hooks -- Do not execute backup hooks
         apps -- List of application names to backup
         ignore_apps -- Do not backup apps
+        compress_jobs -- Number of threads compressing the archive
+        incremental -- Store files into the deduplicated chunks repository
+        jobs -- Maximum number of apps backup scripts to execute concurrently
+        progress_callback -- Function to call with the number of bytes done,
+            the estimated total one - or None - and the current member while
+            storing files, for Python callers only as the progress is logged
+            otherwise
+        compression -- Codec to compress the archive with
+        compression_level -- Compression level of the codec
 
     """
     # TODO: Add a 'clean' argument to clean output directory
@@ -86,6 +122,22 @@ def backup_create(name=None, description=None, output_directory=None,
             m18n.n('backup_archive_name_exists'))
 
     # Validate additional arguments
+    if incremental:
+        # Files are stored as chunks into the repository of local archives
+        for option, is_set in [('no-compress', no_compress),
+                               ('output-directory', output_directory),
+                               ('compression', compression != 'gzip'),
+                               ('compression-level',
+                                compression_level is not None)]:
+            if is_set:
+                raise MoulinetteError(errno.EINVAL,
+                    m18n.n('backup_incremental_option_invalid',
+                           option=option))
+    try:
+        get_codec(compression).check_level(compression_level)
+    except CodecError:
+        raise MoulinetteError(errno.EINVAL,
+            m18n.n('backup_compression_invalid', codec=compression))
     if no_compress and not output_directory:
         raise MoulinetteError(errno.EINVAL,
             m18n.n('backup_output_directory_required'))
@@ -138,6 +190,14 @@ def backup_create(name=None, description=None, output_directory=None,
         'hooks': {},
     }
 
+    # Create the file in which scripts list the paths to backup, so that
+    # they are read from their location while creating the archive
+    csv_path = tmp_dir + '/backup.csv'
+    admin = pwd.getpwnam('admin')
+    open(csv_path, 'w').close()
+    os.chown(csv_path, admin.pw_uid, admin.pw_gid)
+    env = { 'YNH_BACKUP_CSV': csv_path }
+
     # Run system hooks
     if not ignore_hooks:
         # Check hooks availibility
@@ -151,11 +211,18 @@ def backup_create(name=None, description=None, output_directory=None,
                 else:
                     hooks_filtered.add(hook)
 
+        # Record the paths saved by each hook, so that they can be
+        # restored without extracting the others
+        recorder = _HooksPathsRecorder(tmp_dir, csv_path)
+
         if not hooks or hooks_filtered:
             logger.info(m18n.n('backup_running_hooks'))
-            ret = hook_callback('backup', hooks_filtered, args=[tmp_dir])
+            ret = hook_callback('backup', hooks_filtered, args=[tmp_dir],
+                                env=env, pre_callback=recorder.before,
+                                post_callback=recorder.after)
             if ret['succeed']:
                 info['hooks'] = ret['succeed']
+                info['hooks_paths'] = recorder.paths
 
                 # Save relevant restoration hooks
                 tmp_hooks_dir = tmp_dir + '/hooks/restore'
@@ -184,9 +251,10 @@ def backup_create(name=None, description=None, output_directory=None,
         else:
             apps_filtered = apps_list
 
-        # Run apps backup scripts
-        tmp_script = '/tmp/backup_' + str(timestamp)
-        for app_id in apps_filtered:
+        # Run apps backup scripts - concurrently for the ones which are
+        # declared as safe to, each one with its own script and paths list
+        apps_concurrent, apps_serial = [], []
+        for app_id in sorted(apps_filtered):
             app_setting_path = '/etc/yunohost/apps/' + app_id
 
             # Check if the app has a backup and restore script
@@ -198,78 +266,175 @@ def backup_create(name=None, description=None, output_directory=None,
             elif not os.path.isfile(app_restore_script):
                 logger.warning(m18n.n('unrestore_app', app=app_id))
 
-            tmp_app_dir = '{:s}/apps/{:s}'.format(tmp_dir, app_id)
-            tmp_app_bkp_dir = tmp_app_dir + '/backup'
-            logger.info(m18n.n('backup_running_app_script', app=app_id))
-            try:
-                # Prepare backup directory for the app
-                filesystem.mkdir(tmp_app_bkp_dir, 0750, True, uid='admin')
-                shutil.copytree(app_setting_path, tmp_app_dir + '/settings')
-
-                # Copy app backup script in a temporary folder and execute it
-                subprocess.call(['install', '-Dm555', app_script, tmp_script])
-                hook_exec(tmp_script, args=[tmp_app_bkp_dir, app_id],
-                          raise_on_error=True, chdir=tmp_app_bkp_dir)
-            except:
-                logger.exception(m18n.n('backup_app_failed', app=app_id))
-                # Cleaning app backup directory
-                shutil.rmtree(tmp_app_dir, ignore_errors=True)
+            if jobs > 1 and _is_app_backup_concurrent(app_id):
+                apps_concurrent.append(app_id)
             else:
-                # Add app info
-                i = app_info(app_id)
-                info['apps'][app_id] = {
-                    'version': i['version'],
-                    'name': i['name'],
-                    'description': i['description'],
-                }
+                apps_serial.append(app_id)
+
+        apps_succeed = []
+        if apps_concurrent:
+            pool = ThreadPool(min(jobs, len(apps_concurrent)))
+            try:
+                results = [(app_id, pool.apply_async(_backup_app, [
+                        app_id, tmp_dir, timestamp, '[%s] ' % app_id]))
+                    for app_id in apps_concurrent]
+                apps_succeed.extend(app_id for app_id, r in results if r.get())
             finally:
-                filesystem.rm(tmp_script, force=True)
+                pool.terminate()
+                pool.join()
+        for app_id in apps_serial:
+            if _backup_app(app_id, tmp_dir, timestamp):
+                apps_succeed.append(app_id)
+
+        for app_id in apps_succeed:
+            # Append paths listed by the app to the backup ones
+            app_csv_path = _get_app_backup_csv(tmp_dir, app_id)
+            with open(app_csv_path, 'rb') as src, open(csv_path, 'ab') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(app_csv_path)
+
+            # Add app info
+            i = app_info(app_id)
+            info['apps'][app_id] = {
+                'version': i['version'],
+                'name': i['name'],
+                'description': i['description'],
+            }
 
     # Check if something has been saved
     if not info['hooks'] and not info['apps']:
         _clean_tmp_dir(1)
         raise MoulinetteError(errno.EINVAL, m18n.n('backup_nothings_done'))
 
-    # Calculate total size
-    size = subprocess.check_output(
-        ['du','-sb', tmp_dir]).split()[0].decode('utf-8')
-    info['size'] = int(size)
+    # Retrieve the paths listed by the scripts
+    sources = _get_backup_sources(csv_path, tmp_dir)
+    os.remove(csv_path)
+    # Walking the sources to know their size would read every inode twice,
+    # so the total is estimated from the last backup instead
+    progress = _BackupProgress(_get_last_backup_size(), progress_callback)
+
+    if no_compress:
+        # Copy listed paths into the output directory, and calculate the
+        # total size from each copy while its inodes are still cached
+        info['size'] = _get_tree_size(tmp_dir)
+        progress.update(info['size'], None)
+        for src, arcname in sources:
+            dest = os.path.join(tmp_dir, arcname)
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest), 0750)
+            if subprocess.call(['cp', '-a', src, dest]) != 0:
+                logger.warning(m18n.n('backup_source_unavailable', path=src))
+            size = _get_tree_size(dest)
+            info['size'] += size
+            progress.update(size, arcname)
+
+        # Create backup info file
+        with open("%s/info.json" % tmp_dir, 'w') as f:
+            f.write(json.dumps(info))
+
+    # Store files into the chunks repository
+    elif incremental:
+        logger.info(m18n.n('backup_storing_chunks'))
+        if not os.path.isdir(archives_path):
+            os.mkdir(archives_path, 0750)
+
+        # Unchanged files since the last incremental backup are not read
+        store = ChunkStore(chunks_path)
+        try:
+            entries = build_index(store,
+                [(tmp_dir, '')] + [s for s in sources
+                                   if _is_backup_source_available(s[0])],
+                previous=_get_last_chunks_index(), progress=progress.update)
+            _store_chunks_index(name, entries)
+        except:
+            logger.debug("unable to store the backup into '%s'",
+                chunks_path, exc_info=1)
+            store.discard(store.added)
+            _clean_tmp_dir(2)
+            raise MoulinetteError(errno.EIO,
+                m18n.n('backup_chunks_store_failed'))
+        store.add_references(get_index_chunks(entries))
 
-    # Create backup info file
-    with open("%s/info.json" % tmp_dir, 'w') as f:
-        f.write(json.dumps(info))
+        # Create backup info file
+        info['format'] = 'chunks'
+        info['size'] = sum(e.get('size', 0) for e in entries)
+        with open('{:s}/{:s}.info.json'.format(archives_path, name), 'w') as f:
+            f.write(json.dumps(info))
 
     # Create the archive
-    if not no_compress:
+    else:
         logger.info(m18n.n('backup_creating_archive'))
-        archive_file = "%s/%s.tar.gz" % (output_directory, name)
+        archive_file = "%s/%s%s" % (output_directory, name,
+                                    CODECS[compression].extension)
+        def _open_archive():
+            return open_compressed_writer(archive_file, compression,
+                                          compression_level, compress_jobs)
         try:
-            tar = tarfile.open(archive_file, "w:gz")
+            gz = _open_archive()
         except:
-            tar = None
+            gz = None
 
             # Create the archives directory and retry
             if not os.path.isdir(archives_path):
                 os.mkdir(archives_path, 0750)
                 try:
-                    tar = tarfile.open(archive_file, "w:gz")
+                    gz = _open_archive()
                 except:
                     logger.debug("unable to open '%s' for writing",
                         archive_file, exc_info=1)
-                    tar = None
+                    gz = None
             else:
                 logger.debug("unable to open '%s' for writing",
                     archive_file, exc_info=1)
-            if tar is None:
+            if gz is None:
                 _clean_tmp_dir(2)
                 raise MoulinetteError(errno.EIO,
                     m18n.n('backup_archive_open_failed'))
-        tar.add(tmp_dir, arcname='')
+
+        # Listed paths are read from their location and the total size is
+        # calculated while they are added
+        info['size'] = 0
+        def _count_size(tarinfo):
+            info['size'] += tarinfo.size
+            progress.update(tarinfo.size, tarinfo.name)
+            return tarinfo
+
+        # With gzip, blocks of the archive are compressed concurrently, as a
+        # multi-member gzip file which can still be read by tar and
+        # backup_restore. Where members are written is recorded.
+        # Entries which cannot be read are skipped one by one, without
+        # leaving a truncated member into the archive
+        def _skip_entry(path, e):
+            if isinstance(e, ArchiveError):
+                logger.warning(m18n.n('backup_file_truncated', path=path))
+            else:
+                logger.warning(m18n.n('backup_source_unavailable', path=path))
+            logger.debug("unable to archive '%s': %s", path, e)
+
+        info['codec'] = compression
+        tar = IndexedTarFile.open(fileobj=gz, mode='w')
+        tar.add_tree(tmp_dir, '', filter=_count_size, onerror=_skip_entry)
+        for src, arcname in sources:
+            tar.add_tree(src, arcname, filter=_count_size,
+                         onerror=_skip_entry)
+
+        # Add backup info file at the end of the archive
+        info_json = json.dumps(info)
+        tarinfo = tarfile.TarInfo('info.json')
+        tarinfo.size = len(info_json)
+        tarinfo.mtime = int(time.time())
+        tar.addfile(tarinfo, StringIO(info_json))
         tar.close()
+        gz.close()
 
-        # Move info file
-        os.rename(tmp_dir + '/info.json',
-                  '{:s}/{:s}.info.json'.format(archives_path, name))
+        # Write info and members index files next to the archive
+        with open('{:s}/{:s}.info.json'.format(archives_path, name), 'w') as f:
+            f.write(info_json)
+        with open(_get_members_index_file(name), 'w') as f:
+            json.dump({
+                'blocks': getattr(gz, 'blocks', None),
+                'members': tar.members_index,
+            }, f)
 
     # Clean temporary directory
     if tmp_dir != output_directory:
@@ -304,13 +469,43 @@ def backup_restore(auth, name, hooks=[], ignore_hooks=False,
     # Retrieve and open the archive
     info = backup_info(name)
     archive_file = info['path']
+    entries = members_index = None
     try:
-        tar = tarfile.open(archive_file, "r:gz")
+        if archive_file.endswith('.index.gz'):
+            entries = _load_chunks_index(name)
+        else:
+            codec = get_codec(get_codec_from_filename(archive_file)).name
+            members_index = _load_members_index(name)
     except:
         logger.debug("cannot open backup archive '%s'",
             archive_file, exc_info=1)
         raise MoulinetteError(errno.EIO, m18n.n('backup_archive_open_failed'))
 
+    # Select the members needed for what is restored - and the targets of
+    # the needed hard links - when the archive allows to only extract them
+    size = info['size']
+    is_member_needed = _get_restore_members_filter(
+        name, hooks, ignore_hooks, apps, ignore_apps)
+    if entries is not None:
+        is_member_needed = with_link_targets(is_member_needed,
+            [(e['name'], e.get('linkname')) for e in entries
+             if e['type'] == 'hardlink'])
+        entries = [e for e in entries if is_member_needed(e['name'])]
+        size = sum(e.get('size', 0) for e in entries)
+    elif members_index is not None:
+        members = members_index['members']
+        if any(len(m) < 5 for m in members):
+            # Hard links are unknown, the whole archive is needed
+            is_member_needed = lambda name: True
+        else:
+            is_member_needed = with_link_targets(is_member_needed,
+                [(m[0], m[4]) for m in members])
+        size = sum(m[2] for m in members if is_member_needed(m[0]))
+    else:
+        # Hard links are only known while reading the archive, whose
+        # members cannot be selected without extracting their targets
+        is_member_needed = lambda name: True
+
     # Check temporary directory
     tmp_dir = "%s/tmp/%s" % (backup_path, name)
     if os.path.isdir(tmp_dir):
@@ -321,8 +516,8 @@ def backup_restore(auth, name, hooks=[], ignore_hooks=False,
     # Check available disk space
     statvfs = os.statvfs(backup_path)
     free_space = statvfs.f_frsize * statvfs.f_bavail
-    if free_space < info['size']:
-        logger.debug("%dB left but %dB is needed", free_space, info['size'])
+    if free_space < size:
+        logger.debug("%dB left but %dB is needed", free_space, size)
         raise MoulinetteError(
             errno.EIO, m18n.n('not_enough_disk_space', path=backup_path))
 
@@ -335,8 +530,45 @@ def backup_restore(auth, name, hooks=[], ignore_hooks=False,
 
     # Extract the tarball
     logger.info(m18n.n('backup_extracting_archive'))
-    tar.extractall(tmp_dir)
-    tar.close()
+    if members_index is not None and members_index['blocks']:
+        try:
+            extract_tar_members(archive_file, members_index['blocks'],
+                                members_index['members'], tmp_dir,
+                                is_member_needed)
+        except (ArchiveError, IOError, OSError):
+            logger.debug("unable to extract members of '%s'",
+                archive_file, exc_info=1)
+            _clean_tmp_dir(1)
+            raise MoulinetteError(errno.EIO,
+                m18n.n('backup_invalid_archive'))
+    elif entries is None:
+        # Read the whole archive, only extracting the needed members
+        f = None
+        try:
+            f = open_compressed_reader(archive_file, codec)
+            tar = tarfile.open(fileobj=f, mode='r|')
+            for member in tar:
+                if is_member_needed(member.name):
+                    tar.extract(member, tmp_dir)
+        except (tarfile.TarError, IOError, OSError, EOFError):
+            logger.debug("unable to extract '%s'", archive_file, exc_info=1)
+            _clean_tmp_dir(1)
+            raise MoulinetteError(errno.EIO,
+                m18n.n('backup_invalid_archive'))
+        finally:
+            if f is not None:
+                f.close()
+    else:
+        try:
+            extract_index(ChunkStore(chunks_path), entries, tmp_dir)
+            shutil.copy('%s/%s.info.json' % (archives_path, name),
+                        tmp_dir + '/info.json')
+        except (ChunkStoreError, IOError, OSError):
+            logger.debug("unable to restore files from '%s'",
+                chunks_path, exc_info=1)
+            _clean_tmp_dir(1)
+            raise MoulinetteError(errno.EIO,
+                m18n.n('backup_invalid_archive'))
 
     # Retrieve backup info
     info_file = "%s/info.json" % tmp_dir
@@ -462,8 +694,10 @@ def backup_restore(auth, name, hooks=[], ignore_hooks=False,
             try:
                 # Copy app settings and set permissions
                 shutil.copytree(tmp_app_dir + '/settings', app_setting_path)
-                filesystem.chmod(app_setting_path, 0555, 0444, True)
-                filesystem.chmod(app_setting_path + '/settings.yml', 0400)
+                apply_permissions(app_setting_path, [
+                    ('*', None, (0555, 0444)),
+                    ('settings.yml', None, 0400),
+                ])
 
                 # Execute app restore script
                 subprocess.call(['install', '-Dm555', app_script, tmp_script])
@@ -510,11 +744,11 @@ def backup_list(with_info=False, human_readable=False):
     else:
         # Iterate over local archives
         for f in archives:
-            try:
-                name = f[:f.rindex('.tar.gz')]
-            except ValueError:
-                continue
-            result.append(name)
+            codec = get_codec_from_filename(f)
+            if codec is not None:
+                result.append(f[:-len(CODECS[codec].extension)])
+            elif f.endswith('.index.gz'):
+                result.append(f[:-len('.index.gz')])
         result.sort()
 
     if result and with_info:
@@ -536,7 +770,7 @@ def backup_info(name, with_details=False, human_readable=False):
         human_readable -- Print sizes in human readable format
 
     """
-    archive_file = '%s/%s.tar.gz' % (archives_path, name)
+    archive_file = _get_archive_file(name) or _get_chunks_index_file(name)
     if not os.path.isfile(archive_file):
         raise MoulinetteError(errno.EIO,
             m18n.n('backup_archive_name_unknown', name=name))
@@ -553,11 +787,14 @@ def backup_info(name, with_details=False, human_readable=False):
 
     # Retrieve backup size
     size = info.get('size', 0)
-    if not size:
-        tar = tarfile.open(archive_file, "r:gz")
-        size = reduce(lambda x,y: getattr(x, 'size', x)+getattr(y, 'size', y),
-                      tar.getmembers())
-        tar.close()
+    members_index = None if size else _load_members_index(name)
+    if members_index is not None:
+        size = sum(m[2] for m in members_index['members'])
+    elif not size and info.get('format') != 'chunks':
+        f = open_compressed_reader(archive_file,
+                                   get_codec_from_filename(archive_file))
+        size = sum(m.size for m in tarfile.open(fileobj=f, mode='r|'))
+        f.close()
     if human_readable:
         size = binary_to_human(size) + 'B'
 
@@ -572,6 +809,10 @@ def backup_info(name, with_details=False, human_readable=False):
     if with_details:
         for d in ['apps', 'hooks']:
             result[d] = info[d]
+        result['format'] = info.get('format', 'tar')
+        if result['format'] == 'tar':
+            result['codec'] = info.get('codec') or \
+                get_codec_from_filename(archive_file)
     return result
 
 
@@ -585,7 +826,21 @@ def backup_delete(name):
     """
     hook_callback('pre_backup_delete', args=[name])
 
-    archive_file = '%s/%s.tar.gz' % (archives_path, name)
+    archive_file = _get_archive_file(name) or \
+        '%s/%s.tar.gz' % (archives_path, name)
+    if not os.path.isfile(archive_file) \
+            and os.path.isfile(_get_chunks_index_file(name)):
+        archive_file = _get_chunks_index_file(name)
+
+        # Release the chunks used by the backup
+        try:
+            removed = ChunkStore(chunks_path).remove_references(
+                get_index_chunks(_load_chunks_index(name)))
+        except:
+            logger.debug("unable to release chunks of '%s'", name, exc_info=1)
+            raise MoulinetteError(errno.EIO,
+                m18n.n('backup_delete_error', path=archive_file))
+        logger.debug("%d unused chunks removed", removed)
 
     info_file = "%s/%s.info.json" % (archives_path, name)
     for backup_file in [archive_file,info_file]:
@@ -599,6 +854,452 @@ def backup_delete(name):
             raise MoulinetteError(errno.EIO,
                 m18n.n('backup_delete_error', path=backup_file))
 
+    filesystem.rm(_get_members_index_file(name), force=True)
+
     hook_callback('post_backup_delete', args=[name])
 
     logger.success(m18n.n('backup_deleted'))
+
+
+def backup_benchmark(paths=[], sample_size=32, compress_jobs=None):
+    """
+    Benchmark the compression codecs on a sample of the server data
+
+    Keyword arguments:
+        paths -- List of paths to sample data from
+        sample_size -- Size of the data sample in MiB
+        compress_jobs -- Number of threads compressing with gzip
+
+    """
+    paths = [p for p in (paths or ['/etc', '/home', '/var/mail', '/var/www'])
+             if os.path.exists(p)]
+    if not paths:
+        raise MoulinetteError(errno.EINVAL,
+            m18n.n('backup_benchmark_no_data'))
+
+    # Build a tar archive of the sample, taking the same amount of data from
+    # each path
+    logger.info(m18n.n('backup_benchmark_sampling',
+        size=binary_to_human(sample_size * 1024 * 1024) + 'B',
+        paths=', '.join(paths)))
+    sample = StringIO()
+    tar = tarfile.open(fileobj=sample, mode='w')
+    for path in paths:
+        remaining = sample_size * 1024 * 1024 / len(paths)
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                f = os.path.join(root, name)
+                if remaining <= 0:
+                    break
+                try:
+                    if not stat.S_ISREG(os.lstat(f).st_mode):
+                        continue
+                    with open(f, 'rb') as fileobj:
+                        data = fileobj.read(remaining)
+                except (IOError, OSError):
+                    continue
+                tarinfo = tarfile.TarInfo(f.lstrip('/'))
+                tarinfo.size = len(data)
+                tar.addfile(tarinfo, StringIO(data))
+                remaining -= len(data)
+            if remaining <= 0:
+                break
+    tar.close()
+    data = sample.getvalue()
+    if not tar.getmembers():
+        raise MoulinetteError(errno.EINVAL,
+            m18n.n('backup_benchmark_no_data'))
+
+    # Compress the sample with each available codec at a few levels
+    result = []
+    for codec in CODECS.values():
+        if not codec.available:
+            logger.warning(m18n.n('backup_compression_unavailable',
+                codec=codec.name))
+            continue
+        for level in codec.benchmark_levels:
+            logger.info(m18n.n('backup_benchmark_running', codec=codec.name,
+                level='-' if level is None else str(level)))
+            r = benchmark_codec(data, codec.name, level, compress_jobs)
+            result.append(OrderedDict([
+                ('codec', codec.name),
+                ('level', level),
+                ('ratio', round(r['ratio'], 2)),
+                ('size', binary_to_human(r['size']) + 'B'),
+                ('compression_speed',
+                    binary_to_human(r['compress_speed']) + 'B/s'),
+                ('decompression_speed',
+                    binary_to_human(r['decompress_speed']) + 'B/s'),
+            ]))
+
+    return {
+        'sample_size': binary_to_human(len(data)) + 'B',
+        'codecs': result,
+    }
+
+
+def _get_backup_sources(csv_path, tmp_dir, offset=0):
+    """
+    Return the (source, archive name) pairs listed in a backup CSV file
+
+    Keyword arguments:
+        csv_path -- Path of the CSV file filled by the backup scripts
+        tmp_dir -- Directory of the backup in which paths are stored
+        offset -- Position in the file from which to read lines
+
+    """
+    sources = []
+    with open(csv_path, 'rb') as f:
+        f.seek(offset)
+        for row in csv.reader(f):
+            if len(row) != 2:
+                continue
+            src, dest = row
+            arcname = os.path.relpath(os.path.normpath(dest), tmp_dir)
+            if arcname == '.' or arcname.startswith('..'):
+                logger.warning(m18n.n('backup_source_unavailable', path=src))
+                continue
+            sources.append((src, arcname))
+    return sources
+
+
+def _backup_app(app_id, tmp_dir, timestamp, output_prefix=None):
+    """
+    Execute the backup script of an app and return whether it succeeded
+
+    Keyword arguments:
+        app_id -- Instance id of the app
+        tmp_dir -- Directory of the backup
+        timestamp -- Creation time of the backup
+        output_prefix -- String to prepend to each line of the script output
+
+    """
+    app_setting_path = '/etc/yunohost/apps/' + app_id
+    app_script = app_setting_path + '/scripts/backup'
+    tmp_app_dir = '{:s}/apps/{:s}'.format(tmp_dir, app_id)
+    tmp_app_bkp_dir = tmp_app_dir + '/backup'
+    tmp_script = '/tmp/backup_{:s}_{:d}'.format(app_id, timestamp)
+    csv_path = _get_app_backup_csv(tmp_dir, app_id)
+
+    logger.info(m18n.n('backup_running_app_script', app=app_id))
+    try:
+        # Prepare backup directory and paths list for the app
+        filesystem.mkdir(tmp_app_bkp_dir, 0750, True, uid='admin')
+        shutil.copytree(app_setting_path, tmp_app_dir + '/settings')
+        admin = pwd.getpwnam('admin')
+        open(csv_path, 'w').close()
+        os.chown(csv_path, admin.pw_uid, admin.pw_gid)
+
+        # Copy app backup script in a temporary folder and execute it
+        subprocess.call(['install', '-Dm555', app_script, tmp_script])
+        hook_exec(tmp_script, args=[tmp_app_bkp_dir, app_id],
+                  raise_on_error=True, chdir=tmp_app_bkp_dir,
+                  env={ 'YNH_BACKUP_CSV': csv_path },
+                  output_prefix=output_prefix)
+    except:
+        logger.exception(m18n.n('backup_app_failed', app=app_id))
+        # Cleaning app backup directory and listed paths
+        shutil.rmtree(tmp_app_dir, ignore_errors=True)
+        filesystem.rm(csv_path, force=True)
+        return False
+    finally:
+        filesystem.rm(tmp_script, force=True)
+    return True
+
+
+def _get_app_backup_csv(tmp_dir, app_id):
+    """Return the path of the file listing the paths to backup of an app"""
+    return '{:s}/backup_{:s}.csv'.format(tmp_dir, app_id)
+
+
+def _is_app_backup_concurrent(app_id):
+    """Check if the backup script of an app can be executed concurrently"""
+    try:
+        with open('/etc/yunohost/apps/%s/manifest.json' % app_id) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return False
+    value = manifest.get('concurrent_backup', False)
+    return value is True or is_true(value)
+
+
+class _BackupProgress(object):
+    """
+    Report the progress of files being stored into a backup
+
+    The progress is logged at most every `interval` seconds, and given to
+    the optional callback for each member. The `total` size is only an
+    estimation, it is ignored when unknown or once exceeded.
+
+    """
+    interval = 10
+
+    def __init__(self, total, callback=None):
+        self.total = total
+        self.done = 0
+        self.callback = callback
+        self._last_log = time.time()
+
+    def update(self, size, member):
+        self.done += size
+        if self.callback:
+            self.callback(self.done, self.total, member)
+
+        now = time.time()
+        if now - self._last_log < self.interval:
+            return
+        self._last_log = now
+        if self.total and self.done <= self.total:
+            logger.info(m18n.n('backup_progress',
+                done=binary_to_human(self.done) + 'B',
+                total=binary_to_human(self.total) + 'B',
+                percent=int(self.done * 100 / self.total),
+                member=member or '/'))
+        else:
+            logger.info(m18n.n('backup_progress_no_total',
+                done=binary_to_human(self.done) + 'B',
+                member=member or '/'))
+
+
+def _get_tree_size(path):
+    """Return the size of the regular files of a tree, not following links"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return 0
+    if not stat.S_ISDIR(st.st_mode):
+        return st.st_size if stat.S_ISREG(st.st_mode) else 0
+
+    size = 0
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            if scandir is not None:
+                # Use file types from the directory entries to save a stat
+                # call for directories and links
+                for entry in scandir(current):
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        size += entry.stat(follow_symlinks=False).st_size
+            else:
+                for name in os.listdir(current):
+                    p = os.path.join(current, name)
+                    st = os.lstat(p)
+                    if stat.S_ISDIR(st.st_mode):
+                        stack.append(p)
+                    elif stat.S_ISREG(st.st_mode):
+                        size += st.st_size
+        except OSError:
+            logger.debug("unable to get the size of '%s'", current, exc_info=1)
+    return size
+
+
+def _get_restore_members_filter(name, hooks=[], ignore_hooks=False,
+                                apps=[], ignore_apps=False):
+    """
+    Return a function telling if a member of a backup is needed to restore
+    the given hooks and apps
+
+    Keyword arguments:
+        name -- Name of the local backup archive
+        hooks -- List of restoration hooks names to execute
+        ignore_hooks -- Do not execute backup hooks
+        apps -- List of application names to restore
+        ignore_apps -- Do not restore apps
+
+    """
+    with open('%s/%s.info.json' % (archives_path, name)) as f:
+        hooks_paths = json.load(f).get('hooks_paths')
+
+    # Retrieve the paths saved by the hooks to restore - and the ones needed
+    # by the restoration itself - or restore everything if unknown
+    paths = ['info.json', 'yunohost/current_host']
+    if not ignore_hooks:
+        if hooks_paths is None:
+            paths = None
+        else:
+            paths.append('hooks')
+            for n, l in hooks_paths.items():
+                if not hooks or any(n == h or n.startswith(h + '_')
+                                    for h in hooks):
+                    paths.extend(l)
+
+    def _is_member_needed(member):
+        parts = member.split('/')
+        if parts[0] == 'apps':
+            return not ignore_apps and \
+                (len(parts) == 1 or not apps or parts[1] in apps)
+        if paths is None or not member:
+            return True
+        # Keep parent directories of the needed paths as well
+        return any(member == p or member.startswith(p + '/')
+                   or p.startswith(member + '/') for p in paths)
+    return _is_member_needed
+
+
+class _HooksPathsRecorder(object):
+    """
+    Record the paths saved by each backup hook, relative to tmp_dir
+
+    Hooks save their files into their own directories, which may share
+    parents with the ones of other hooks. The top-most paths created by a
+    hook are attributed to it, as well as the paths it lists into the CSV
+    file. Only the entries of the directories which could receive paths
+    of the next hooks - the shared parents and the attributed directories -
+    are listed around each hook, instead of walking the whole tree. An
+    attributed directory which receives a path from another hook becomes a
+    shared parent, and its previous content is attributed instead.
+
+    """
+
+    def __init__(self, tmp_dir, csv_path):
+        self.tmp_dir = tmp_dir
+        self.csv_path = csv_path
+        self.paths = {}
+        self._owners = {}
+        self._shared = set([''])
+        self._listings = {}
+        self._csv_size = 0
+
+    def before(self, name, priority, path):
+        self._listings = {}
+        for d in self._shared | set(p for p in self._owners
+                                    if self._is_dir(p)):
+            self._listings[d] = self._listdir(d)
+        self._csv_size = os.path.getsize(self.csv_path)
+
+    def after(self, name, priority, path, succeed):
+        if not succeed:
+            return
+        paths = self.paths.setdefault(name, [])
+        for d, before in self._listings.items():
+            new = self._listdir(d) - before
+            if not new:
+                continue
+            self._share(d, before)
+            for n in sorted(new):
+                self._owners[os.path.join(d, n)] = name
+                paths.append(os.path.join(d, n))
+
+        # Listed paths are not in tmp_dir but may be below attributed ones
+        for _, arcname in _get_backup_sources(
+                self.csv_path, self.tmp_dir, self._csv_size):
+            parts = arcname.split(os.sep)
+            for i in range(1, len(parts)):
+                d = os.path.join(*parts[:i])
+                if self._owners.get(d, name) != name:
+                    self._share(d, self._listdir(d))
+            paths.append(arcname)
+
+    def _share(self, path, content):
+        """Attribute the content of a directory instead of itself"""
+        owner = self._owners.pop(path, None)
+        if owner is None:
+            return
+        self.paths[owner].remove(path)
+        for n in sorted(content):
+            self._owners[os.path.join(path, n)] = owner
+            self.paths[owner].append(os.path.join(path, n))
+        self._shared.add(path)
+
+    def _is_dir(self, path):
+        try:
+            st = os.lstat(os.path.join(self.tmp_dir, path))
+        except OSError:
+            return False
+        return stat.S_ISDIR(st.st_mode)
+
+    def _listdir(self, path):
+        try:
+            return set(os.listdir(os.path.join(self.tmp_dir, path)))
+        except OSError:
+            return set()
+
+
+def _is_backup_source_available(path):
+    """Check if a path listed by a backup script exists"""
+    if os.path.lexists(path):
+        return True
+    logger.warning(m18n.n('backup_source_unavailable', path=path))
+    return False
+
+
+def _get_archive_file(name):
+    """Return the path of the local archive of a backup, whatever its codec"""
+    for codec in CODECS.values():
+        archive_file = '%s/%s%s' % (archives_path, name, codec.extension)
+        if os.path.isfile(archive_file):
+            return archive_file
+    return None
+
+
+def _get_members_index_file(name):
+    """Return the path of the members index of a backup archive"""
+    return '%s/%s.members.json' % (archives_path, name)
+
+
+def _load_members_index(name):
+    """Load the members index of a backup archive, if any"""
+    try:
+        with open(_get_members_index_file(name)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def _get_chunks_index_file(name):
+    """Return the path of the index of an incremental backup"""
+    return '%s/%s.index.gz' % (archives_path, name)
+
+
+def _load_chunks_index(name):
+    """Load the index of an incremental backup"""
+    with gzip.open(_get_chunks_index_file(name), 'rb') as f:
+        return json.load(f)
+
+
+def _store_chunks_index(name, entries):
+    """Write the index of an incremental backup"""
+    index_file = _get_chunks_index_file(name)
+    with gzip.open(index_file + '.tmp', 'wb') as f:
+        json.dump(entries, f)
+    os.rename(index_file + '.tmp', index_file)
+
+
+def _get_last_backup_size():
+    """Return the size of the most recent backup, if any"""
+    last = None
+    for name in backup_list()['archives']:
+        try:
+            with open('%s/%s.info.json' % (archives_path, name)) as f:
+                info = json.load(f)
+            created_at, size = info['created_at'], int(info['size'])
+        except:
+            continue
+        if last is None or created_at > last[0]:
+            last = (created_at, size)
+    return last[1] if last else None
+
+
+def _get_last_chunks_index():
+    """Return the index of the most recent incremental backup, if any"""
+    last = None
+    for name in backup_list()['archives']:
+        if not os.path.isfile(_get_chunks_index_file(name)):
+            continue
+        try:
+            with open('%s/%s.info.json' % (archives_path, name)) as f:
+                created_at = json.load(f)['created_at']
+        except:
+            continue
+        if last is None or created_at > last[0]:
+            last = (created_at, name)
+    if last is None:
+        return None
+    try:
+        return _load_chunks_index(last[1])
+    except:
+        logger.debug("unable to load the index of '%s'", last[1], exc_info=1)
+        return None
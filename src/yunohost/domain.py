@@ -185,21 +185,16 @@ def domain_remove(auth, domain, force=False):
     """
     from yunohost.service import service_regenconf
     from yunohost.hook import hook_callback
+    from yunohost.app import _get_app_settings
 
     if not force and domain not in domain_list(auth)['domains']:
         raise MoulinetteError(errno.EINVAL, m18n.n('domain_unknown'))
 
     # Check if apps are installed on the domain
     for app in os.listdir('/etc/yunohost/apps/'):
-        with open('/etc/yunohost/apps/' + app +'/settings.yml') as f:
-            try:
-                app_domain = yaml.load(f)['domain']
-            except:
-                continue
-            else:
-                if app_domain == domain:
-                    raise MoulinetteError(errno.EPERM,
-                                          m18n.n('domain_uninstall_app_first'))
+        if _get_app_settings(app).get('domain') == domain:
+            raise MoulinetteError(errno.EPERM,
+                                  m18n.n('domain_uninstall_app_first'))
 
     if auth.remove('virtualdomain=' + domain + ',ou=domains') or force:
         os.system('rm -rf /etc/yunohost/certs/%s' % domain)
@@ -28,6 +28,7 @@ import sys
 import re
 import json
 import errno
+import pipes
 import subprocess
 from glob import iglob
 
@@ -205,7 +206,8 @@ def hook_list(action, list_by='name', show_info=False):
     return { 'hooks': result }
 
 
-def hook_callback(action, hooks=[], args=None):
+def hook_callback(action, hooks=[], args=None, env=None,
+                  pre_callback=None, post_callback=None):
     """
     Execute all scripts binded to an action
 
@@ -213,6 +215,11 @@ def hook_callback(action, hooks=[], args=None):
         action -- Action name
         hooks -- List of hooks names to execute
         args -- Ordered list of arguments to pass to the script
+        env -- Dict of environment variables to pass to the script
+        pre_callback -- Function to call with the hook name, priority and
+            path before executing it
+        post_callback -- Function to call with the hook name, priority,
+            path and whether it succeeded after executing it
 
     """
     result = { 'succeed': {}, 'failed': {} }
@@ -263,11 +270,17 @@ def hook_callback(action, hooks=[], args=None):
         for name, info in iter(hooks_dict[priority].items()):
             state = 'succeed'
             filename = '%s-%s' % (priority, name)
+            if pre_callback:
+                pre_callback(name, priority, info['path'])
             try:
-                hook_exec(info['path'], args=args, raise_on_error=True)
+                hook_exec(info['path'], args=args, raise_on_error=True,
+                          env=env)
             except MoulinetteError as e:
                 logger.error(str(e))
                 state = 'failed'
+            if post_callback:
+                post_callback(name, priority, info['path'],
+                              state == 'succeed')
             try:
                 result[state][name].append(info['path'])
             except KeyError:
@@ -276,7 +289,7 @@ def hook_callback(action, hooks=[], args=None):
 
 
 def hook_exec(path, args=None, raise_on_error=False, no_trace=False,
-              chdir=None):
+              chdir=None, env=None, output_prefix=None):
     """
     Execute hook from a file with arguments
 
@@ -286,6 +299,8 @@ def hook_exec(path, args=None, raise_on_error=False, no_trace=False,
         raise_on_error -- Raise if the script returns a non-zero exit code
         no_trace -- Do not print each command that will be executed
         chdir -- The directory from where the script will be executed
+        env -- Dict of environment variables to pass to the script
+        output_prefix -- String to prepend to each line of the output
 
     """
     from moulinette.utils.process import call_async_output
@@ -310,14 +325,20 @@ def hook_exec(path, args=None, raise_on_error=False, no_trace=False,
     else:
         cmd_script = path
 
+    # Pass environment variables through sudo, which resets them
+    cmd_env = ''
+    if env:
+        cmd_env = ''.join('{0}={1} '.format(k, pipes.quote(str(v)))
+                          for k, v in sorted(env.items()))
+
     # Construct command to execute
     command = ['sudo', '-n', '-u', 'admin', '-H', 'sh', '-c']
     if no_trace:
-        cmd = '/bin/bash "{script}" {args}'
+        cmd = '{env}/bin/bash "{script}" {args}'
     else:
         # use xtrace on fd 7 which is redirected to stdout
-        cmd = 'BASH_XTRACEFD=7 /bin/bash -x "{script}" {args} 7>&1'
-    command.append(cmd.format(script=cmd_script, args=cmd_args))
+        cmd = '{env}BASH_XTRACEFD=7 /bin/bash -x "{script}" {args} 7>&1'
+    command.append(cmd.format(env=cmd_env, script=cmd_script, args=cmd_args))
 
     if logger.isEnabledFor(log.DEBUG):
         logger.info(m18n.n('executing_command', command=' '.join(command)))
@@ -325,9 +346,10 @@ def hook_exec(path, args=None, raise_on_error=False, no_trace=False,
         logger.info(m18n.n('executing_script', script=path))
 
     # Define output callbacks and call command
+    prefix = output_prefix or ''
     callbacks = (
-        lambda l: logger.info(l.rstrip()),
-        lambda l: logger.warning(l.rstrip()),
+        lambda l: logger.info(prefix + l.rstrip()),
+        lambda l: logger.warning(prefix + l.rstrip()),
     )
     returncode = call_async_output(
         command, callbacks, shell=False, cwd=chdir
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the conditional fetching of apps lists
+
+    Run as root on a YunoHost system with:
+        python -m unittest discover -s /usr/lib/moulinette/yunohost/tests
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import threading
+import __builtin__
+import BaseHTTPServer
+
+try:
+    import moulinette
+    from moulinette.core import MoulinetteError
+    from yunohost import app
+except ImportError:
+    app = None
+
+LIST_NAME = 'unittest_fetchlist'
+
+
+class _ListHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve the list of the server, honoring its validators"""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+
+        etag = self.headers.get('If-None-Match')
+        since = self.headers.get('If-Modified-Since')
+        if server.always_not_modified or \
+                (etag is not None and etag == server.etag) or \
+                (etag is None and since is not None
+                 and since == server.last_modified):
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(server.content)))
+        self.send_header('ETag', server.etag)
+        self.send_header('Last-Modified', server.last_modified)
+        self.end_headers()
+        self.wfile.write(server.content)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(app is None, "moulinette is not installed")
+@unittest.skipIf(os.geteuid() != 0, "must be run as root")
+class AppFetchlistTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if not hasattr(__builtin__, 'm18n'):
+            moulinette.init()
+            m18n.load_namespace('yunohost')
+
+    def setUp(self):
+        self.repo_path = app.repo_path
+        app.repo_path = tempfile.mkdtemp()
+
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _ListHandler)
+        self.server.requests = []
+        self.server.always_not_modified = False
+        self._set_list({'app': {}}, '"v1"', 'Mon, 03 Oct 2016 10:00:00 GMT')
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/list.json' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(app.repo_path, ignore_errors=True)
+        app.repo_path = self.repo_path
+        try:
+            os.remove('/etc/cron.d/yunohost-applist-%s' % LIST_NAME)
+        except OSError:
+            pass
+
+    def _set_list(self, content, etag, last_modified):
+        self.server.content = json.dumps(content)
+        self.server.etag = etag
+        self.server.last_modified = last_modified
+
+    def _fetch(self, url=None):
+        app.app_fetchlist(url=url or self.url, name=LIST_NAME)
+
+    def _read_list(self):
+        with open('%s/%s.json' % (app.repo_path, LIST_NAME)) as f:
+            return json.load(f)
+
+    def _read_validators(self):
+        with open('%s/%s.validators' % (app.repo_path, LIST_NAME)) as f:
+            return json.load(f)
+
+    def _write_validators(self, validators):
+        with open('%s/%s.validators' % (app.repo_path, LIST_NAME), 'w') as f:
+            json.dump(validators, f)
+
+    def test_list_and_validators_stored(self):
+        self._fetch()
+        self.assertNotIn('if-none-match', self.server.requests[0])
+        self.assertNotIn('if-modified-since', self.server.requests[0])
+        self.assertEqual(self._read_list(), {'app': {}})
+        self.assertEqual(self._read_validators(), {
+            'url': self.url,
+            'etag': '"v1"',
+            'last_modified': 'Mon, 03 Oct 2016 10:00:00 GMT',
+        })
+
+    def test_unchanged_list_kept(self):
+        self._fetch()
+        list_file = '%s/%s.json' % (app.repo_path, LIST_NAME)
+        mtime = os.stat(list_file).st_mtime
+        os.utime(list_file, (mtime - 60, mtime - 60))
+
+        self._fetch()
+        headers = self.server.requests[1]
+        self.assertEqual(headers.get('if-none-match'), '"v1"')
+        self.assertEqual(headers.get('if-modified-since'),
+                         'Mon, 03 Oct 2016 10:00:00 GMT')
+        self.assertEqual(os.stat(list_file).st_mtime, mtime - 60)
+        self.assertEqual(self._read_list(), {'app': {}})
+
+    def test_stale_validators_replaced(self):
+        self._fetch()
+        self._set_list({'app': {}, 'other': {}}, '"v2"',
+                       'Tue, 04 Oct 2016 10:00:00 GMT')
+
+        self._fetch()
+        self.assertEqual(self.server.requests[1].get('if-none-match'), '"v1"')
+        self.assertEqual(self._read_list(), {'app': {}, 'other': {}})
+        validators = self._read_validators()
+        self.assertEqual(validators['etag'], '"v2"')
+        self.assertEqual(validators['last_modified'],
+                         'Tue, 04 Oct 2016 10:00:00 GMT')
+
+    def test_validators_of_another_url_ignored(self):
+        self._write_validators({
+            'url': self.url + '?old',
+            'etag': '"v1"',
+            'last_modified': 'Mon, 03 Oct 2016 10:00:00 GMT',
+        })
+        with open('%s/%s.json' % (app.repo_path, LIST_NAME), 'w') as f:
+            f.write('{}')
+
+        self._fetch()
+        self.assertNotIn('if-none-match', self.server.requests[0])
+        self.assertEqual(self._read_list(), {'app': {}})
+        self.assertEqual(self._read_validators()['url'], self.url)
+
+    def test_validators_without_list_ignored(self):
+        self._write_validators({
+            'url': self.url,
+            'etag': '"v1"',
+            'last_modified': 'Mon, 03 Oct 2016 10:00:00 GMT',
+        })
+
+        self._fetch()
+        self.assertNotIn('if-none-match', self.server.requests[0])
+        self.assertEqual(self._read_list(), {'app': {}})
+
+    def test_not_modified_without_cached_list(self):
+        self.server.always_not_modified = True
+        self.assertRaises(MoulinetteError, self._fetch)
+        self.assertFalse(os.path.exists(
+            '%s/%s.json' % (app.repo_path, LIST_NAME)))
+        self.assertFalse(os.path.exists(
+            '%s/%s.validators' % (app.repo_path, LIST_NAME)))
+
+
+if __name__ == '__main__':
+    unittest.main()
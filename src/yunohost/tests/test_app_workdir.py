@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the working folders of app scripts
+
+    Run as root on a YunoHost system with:
+        python -m unittest discover -s /usr/lib/moulinette/yunohost/tests
+"""
+import os
+import pwd
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+try:
+    from yunohost import app
+except ImportError:
+    app = None
+
+
+def _admin_exists():
+    try:
+        pwd.getpwnam('admin')
+    except KeyError:
+        return False
+    return True
+
+
+@unittest.skipIf(app is None, "moulinette is not installed")
+@unittest.skipIf(os.geteuid() != 0 or not _admin_exists(),
+                 "must be run as root with an admin user")
+class AppWorkDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.install_tmp = app.install_tmp
+        app.install_tmp = tempfile.mkdtemp()
+        os.chmod(app.install_tmp, 0755)
+
+    def tearDown(self):
+        shutil.rmtree(app.install_tmp, ignore_errors=True)
+        app.install_tmp = self.install_tmp
+
+    def _run_as_admin(self, script):
+        # Execute the script as hook_exec does
+        return subprocess.call(['sudo', '-n', '-u', 'admin', '-H', 'sh', '-c',
+                                '/bin/bash "{0}"'.format(script)],
+                               cwd=os.path.dirname(script))
+
+    def _make_app_folder(self, work_dir):
+        folder = os.path.join(work_dir, 'myapp')
+        os.makedirs(folder + '/scripts')
+        os.makedirs(folder + '/conf')
+        with open(folder + '/conf/app.conf', 'w') as f:
+            f.write('conf\n')
+        script = folder + '/scripts/upgrade'
+        with open(script, 'w') as f:
+            f.write('set -e\n'
+                    'cd "$(dirname $0)"/..\n'
+                    'ls "$PWD/.." > /dev/null\n'
+                    'cat ../myapp/conf/app.conf > /dev/null\n')
+        subprocess.check_call(['chown', '-hR', 'admin:', folder])
+        return script
+
+    def test_work_dir_owned_by_admin(self):
+        work_dir = app._make_work_dir('upgrade_')
+        s = os.stat(work_dir)
+        self.assertEqual(s.st_uid, pwd.getpwnam('admin').pw_uid)
+
+    def test_script_executed_from_work_dir(self):
+        work_dir = app._make_work_dir('upgrade_')
+        script = self._make_app_folder(work_dir)
+        self.assertEqual(self._run_as_admin(script), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the selective extraction of indexed archives
+
+    Run with:
+        python -m unittest discover -s /usr/lib/moulinette/yunohost/tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from yunohost.utils.archive import (
+    ArchiveError, IndexedTarFile, extract_tar_members
+)
+from yunohost.utils.compression import ParallelGzipFile
+
+
+class ExtractTarMembersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp_dir, 'src')
+        self.dest = os.path.join(self.tmp_dir, 'dest')
+        os.makedirs(os.path.join(self.src, 'a', 'b'))
+        os.makedirs(os.path.join(self.src, 'c'))
+        with open(os.path.join(self.src, 'a', 'b', 'f1'), 'w') as f:
+            f.write('content\n')
+        os.link(os.path.join(self.src, 'a', 'b', 'f1'),
+                os.path.join(self.src, 'c', 'hard'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _make_archive(self, block_size=None):
+        path = os.path.join(self.tmp_dir, 'archive.tar.gz')
+        gz = ParallelGzipFile(path, jobs=1, block_size=block_size)
+        tar = IndexedTarFile.open(fileobj=gz, mode='w')
+        tar.add_tree(self.src, '')
+        tar.close()
+        gz.close()
+        return path, gz.blocks, tar.members_index
+
+    def test_hard_link_target_extracted(self):
+        path, blocks, members = self._make_archive()
+        extract_tar_members(path, blocks, members, self.dest,
+                            lambda name: name.startswith('c/'))
+        hard = os.path.join(self.dest, 'c', 'hard')
+        with open(hard) as f:
+            self.assertEqual(f.read(), 'content\n')
+        self.assertEqual(os.stat(hard).st_nlink, 2)
+
+    def test_hard_link_target_in_previous_run(self):
+        # Small blocks so that each member is read from its own run
+        path, blocks, members = self._make_archive(block_size=512)
+        extract_tar_members(path, blocks, members, self.dest,
+                            lambda name: name in ('a/b/f1', 'c/hard'))
+        self.assertTrue(os.path.isfile(os.path.join(self.dest, 'c', 'hard')))
+
+    def test_unknown_hard_link_target(self):
+        path, blocks, members = self._make_archive()
+        # Index written without the links targets
+        members = [m[:4] for m in members]
+        self.assertRaises(ArchiveError, extract_tar_members, path, blocks,
+                          members, self.dest, lambda name: name == 'c/hard')
+
+
+if __name__ == '__main__':
+    unittest.main()
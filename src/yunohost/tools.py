@@ -39,7 +39,10 @@ import apt.progress
 
 from moulinette.core import MoulinetteError, init_authenticator
 from moulinette.utils.log import getActionLogger
-from yunohost.app import app_fetchlist, app_info, app_upgrade, app_ssowatconf, app_list
+from yunohost.app import (
+    app_fetchlist, app_upgrade, app_ssowatconf, app_list,
+    _get_apps_catalog, _get_apps_inventory
+)
 from yunohost.domain import domain_add, domain_list, get_public_ip
 from yunohost.dyndns import dyndns_subscribe
 from yunohost.firewall import firewall_upnp, firewall_reload
@@ -316,16 +319,17 @@ def tools_update(ignore_apps=False, ignore_packages=False):
             app_fetchlist()
         except MoulinetteError:
             pass
-        app_list = os.listdir(apps_setting_path)
-        if len(app_list) > 0:
-            for app_id in app_list:
+        inventory = _get_apps_inventory()
+        catalog = _get_apps_catalog()['apps']
+        if len(inventory) > 0:
+            for app_id in inventory.keys():
                 if '__' in app_id:
                     original_app_id = app_id[:app_id.index('__')]
                 else:
                     original_app_id = app_id
 
-                current_app_dict = app_info(app_id,  raw=True)
-                new_app_dict     = app_info(original_app_id, raw=True)
+                current_app_dict = inventory[app_id]
+                new_app_dict     = catalog.get(original_app_id)
 
                 # Custom app
                 if new_app_dict is None or 'lastUpdate' not in new_app_dict or 'git' not in new_app_dict:
@@ -417,6 +417,42 @@ def user_info(auth, username):
     else:
         raise MoulinetteError(167, m18n.n('user_info_failed'))
 
+
+def _get_existing_users(auth, usernames):
+    """
+    Get which ones of the given users exist
+
+    Users are looked for with as few LDAP searches as possible, by chunks
+    of OR filters, instead of one search per user.
+
+    Keyword argument:
+        usernames -- List of usernames or mails to look for
+
+    Returns:
+        The set of given usernames or mails which exist
+
+    """
+    from ldap.filter import escape_filter_chars
+
+    usernames = set(usernames)
+    uids, mails = set(), set()
+
+    names = sorted(usernames)
+    for i in range(0, len(names), 100):
+        filter = '(&(objectclass=person)(!(uid=root))(!(uid=nobody))' \
+                 '(|%s))' % ''.join(
+            '(%s=%s)' % ('mail' if '@' in name else 'uid',
+                         escape_filter_chars(name))
+            for name in names[i:i+100])
+        for user in auth.search('ou=users,dc=yunohost,dc=org',
+                                filter, ['uid', 'mail']):
+            uids.update(u.lower() for u in user.get('uid', []))
+            mails.update(m.lower() for m in user.get('mail', []))
+
+    return set(name for name in usernames
+               if name.lower() in (mails if '@' in name else uids))
+
+
 def _convertSize(num, suffix=''):
     for unit in ['K','M','G','T','P','E','Z']:
         if abs(num) < 1024.0:
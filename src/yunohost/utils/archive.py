@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+""" License
+
+    Copyright (C) 2016 YUNOHOST.ORG
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program; if not, see http://www.gnu.org/licenses
+
+"""
+import os
+import stat
+import errno
+import zlib
+import shutil
+import logging
+import tarfile
+import zipfile
+
+from yunohost.utils.compression import GzipBlockReader
+
+logger = logging.getLogger('yunohost.utils.archive')
+
+
+# Exceptions -----------------------------------------------------------------
+
+class ArchiveError(Exception):
+    """The archive cannot be extracted
+
+    Raised if the archive format is not supported, if it is corrupted or if
+    one of its members would be written outside of the destination.
+
+    """
+
+
+# Indexed tar archives -------------------------------------------------------
+
+class IndexedTarFile(tarfile.TarFile):
+    """Tar archive recording where its members are written
+
+    For each added member, a [name, offset, size, crc32, linkname] entry is
+    appended to `members` - where offset is the position of its first header
+    in the uncompressed stream, crc32 the checksum of its content, if any,
+    and linkname the target of a hard link - so that members can later be
+    extracted with extract_tar_members without reading the whole archive.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        tarfile.TarFile.__init__(self, *args, **kwargs)
+        self.members_index = []
+
+    def addfile(self, tarinfo, fileobj=None):
+        offset = self.offset
+        if fileobj is not None:
+            fileobj = _ChecksumReader(fileobj)
+        tarfile.TarFile.addfile(self, tarinfo, fileobj)
+        self.members_index.append([
+            tarinfo.name, offset, tarinfo.size,
+            fileobj.crc32 if fileobj is not None else None,
+            tarinfo.linkname if tarinfo.islnk() else None,
+        ])
+
+    def add_tree(self, name, arcname, filter=None, onerror=None):
+        """Add a path recursively, skipping only the entries which fail
+
+        Each entry is stat'ed - and opened for regular files - before its
+        header is written, so that an entry which vanished or cannot be
+        read is skipped alone, without its siblings. A file which shrinks
+        or fails while being read is padded with zeros to keep the archive
+        consistent. In both cases, the optional `onerror` callable is
+        given the path and the exception - an ArchiveError for a padded
+        file.
+
+        """
+        f = None
+        try:
+            st = os.lstat(name)
+            if stat.S_ISREG(st.st_mode):
+                f = open(name, 'rb')
+            tarinfo = self.gettarinfo(name, arcname, fileobj=f)
+        except (IOError, OSError) as e:
+            if f is not None:
+                f.close()
+            if onerror:
+                onerror(name, e)
+            return
+        if tarinfo is not None and filter:
+            tarinfo = filter(tarinfo)
+        if tarinfo is None:
+            if f is not None:
+                f.close()
+            return
+
+        if tarinfo.isreg():
+            reader = _PaddedReader(f, tarinfo.size)
+            try:
+                self.addfile(tarinfo, reader)
+            finally:
+                f.close()
+            if reader.padded and onerror:
+                onerror(name, ArchiveError(
+                    "{0} bytes of '{1}' are missing".format(
+                        reader.padded, name)))
+            return
+        self.addfile(tarinfo)
+
+        if tarinfo.isdir():
+            try:
+                names = sorted(os.listdir(name))
+            except OSError as e:
+                if onerror:
+                    onerror(name, e)
+                return
+            for n in names:
+                self.add_tree(os.path.join(name, n),
+                              os.path.join(arcname, n), filter, onerror)
+
+
+def extract_tar_members(path, blocks, members, dest, select):
+    """Extract the members of an indexed tar.gz archive matching select
+
+    `blocks` and `members` are the gzip blocks and members indexes of an
+    archive written by an IndexedTarFile into a ParallelGzipFile, and
+    `select` a callable returning whether a member name must be extracted.
+    The targets of the selected hard links are extracted as well. Only the
+    blocks holding the selected members are read, each run of consecutive
+    ones being read in a single pass, and the checksum of extracted files
+    is verified.
+
+    """
+    select = with_link_targets(select, [(m[0], m[4]) for m in members
+                                        if len(m) > 4])
+    runs = []
+    previous = False
+    for m in members:
+        selected = select(m[0])
+        if selected:
+            if not previous:
+                runs.append([])
+            runs[-1].append(m)
+        previous = selected
+
+    with open(path, 'rb') as f:
+        for run in runs:
+            start = run[0][1]
+            tar = tarfile.open(fileobj=GzipBlockReader(f, blocks, start),
+                               mode='r|')
+            try:
+                for m in run:
+                    member = tar.next()
+                    if member is None or m[0] != member.name \
+                            or start + member.offset != m[1]:
+                        raise ArchiveError(
+                            "Member '{0}' not found".format(m[0]))
+                    tar.extract(member, dest)
+                    if m[3] is not None and member.isreg() \
+                            and _get_crc32(os.path.join(dest, m[0])) != m[3]:
+                        raise ArchiveError(
+                            "Member '{0}' is corrupted".format(m[0]))
+            except (tarfile.TarError, KeyError) as e:
+                # A hard link whose target was not extracted is looked for
+                # in the previous members of the run
+                raise ArchiveError(str(e))
+
+
+def with_link_targets(select, links):
+    """Extend a members filter to the targets of the links it selects
+
+    `links` is an iterable of (name, target) pairs of hard link members,
+    the target being None for other members.
+
+    """
+    targets = set(t for n, t in links if t is not None and select(n))
+    if not targets:
+        return select
+    return lambda name: name in targets or select(name)
+
+
+class _ChecksumReader(object):
+    """Compute the checksum of a file while it is read"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.crc32 = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        return data
+
+
+class _PaddedReader(object):
+    """Read exactly `size` bytes of a file, padding it with zeros"""
+
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.remaining = size
+        self.padded = 0
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = ''
+        try:
+            while len(data) < size:
+                chunk = self.fileobj.read(size - len(data))
+                if not chunk:
+                    break
+                data += chunk
+        except (IOError, OSError):
+            logger.debug("unable to read '%s'",
+                getattr(self.fileobj, 'name', None), exc_info=1)
+        if len(data) < size:
+            self.padded += size - len(data)
+            data += '\0' * (size - len(data))
+        self.remaining -= size
+        return data
+
+
+def _get_crc32(path):
+    crc32 = 0
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(1024 * 1024), ''):
+            crc32 = zlib.crc32(data, crc32)
+    return crc32
+
+
+# Extraction -----------------------------------------------------------------
+
+def extract_archive(path, dest, uid=None, gid=None):
+    """Extract a zip or tar archive - or copy a directory - into dest
+
+    Members are written in a single pass from the archive, and their owner
+    is set to `uid` and `gid` - if given - while they are created, so that
+    no recursive chown is needed afterwards. The modes stored in the archive
+    are kept, directories ones being applied once their content is written.
+    Only directories, regular files, symbolic and hard links are extracted
+    and any member which would be written outside of `dest` is refused.
+
+    """
+    writer = _ArchiveWriter(dest, uid, gid)
+
+    if os.path.isdir(path):
+        _copy_directory(path, writer)
+    elif zipfile.is_zipfile(path):
+        try:
+            _extract_zip(path, writer)
+        except (zipfile.BadZipfile, zipfile.LargeZipFile) as e:
+            raise ArchiveError(str(e))
+    elif os.path.isfile(path) and tarfile.is_tarfile(path):
+        try:
+            _extract_tar(path, writer)
+        except tarfile.TarError as e:
+            raise ArchiveError(str(e))
+    else:
+        raise ArchiveError("Unsupported archive '{0}'".format(path))
+
+    writer.close()
+
+
+def _extract_zip(path, writer):
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            mode = info.external_attr >> 16
+            if info.filename.endswith('/') or stat.S_ISDIR(mode):
+                writer.add_directory(info.filename, stat.S_IMODE(mode))
+            elif stat.S_ISLNK(mode):
+                writer.add_symlink(info.filename, zf.read(info))
+            else:
+                with zf.open(info) as src:
+                    writer.add_file(info.filename, src, stat.S_IMODE(mode))
+
+
+def _extract_tar(path, writer):
+    with tarfile.open(path, 'r|*') as tar:
+        for member in tar:
+            if member.isdir():
+                writer.add_directory(member.name, member.mode)
+            elif member.isreg():
+                writer.add_file(member.name, tar.extractfile(member),
+                                member.mode)
+            elif member.issym():
+                writer.add_symlink(member.name, member.linkname)
+            elif member.islnk():
+                writer.add_hardlink(member.name, member.linkname)
+            else:
+                logger.debug("skipping special member '%s'", member.name)
+
+
+def _copy_directory(path, writer):
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            src = os.path.join(root, name)
+            arcname = os.path.relpath(src, path)
+            s = os.lstat(src)
+            if stat.S_ISDIR(s.st_mode):
+                writer.add_directory(arcname, stat.S_IMODE(s.st_mode))
+            elif stat.S_ISREG(s.st_mode):
+                with open(src, 'rb') as f:
+                    writer.add_file(arcname, f, stat.S_IMODE(s.st_mode))
+            elif stat.S_ISLNK(s.st_mode):
+                writer.add_symlink(arcname, os.readlink(src))
+            else:
+                logger.debug("skipping special file '%s'", src)
+
+
+class _ArchiveWriter(object):
+    """Write archive members into a destination directory
+
+    The directories known not to be behind a link - created by the writer
+    or checked once - are kept, so that the path of most members is
+    validated without any system call.
+
+    """
+
+    def __init__(self, dest, uid=None, gid=None):
+        self.dest = os.path.realpath(dest)
+        self.uid = -1 if uid is None else uid
+        self.gid = -1 if gid is None else gid
+        self.chown = uid is not None or gid is not None
+        self._dirs_mode = {}
+        self._dirs = set()
+        self._umask = os.umask(0)
+        os.umask(self._umask)
+
+        if not os.path.isdir(os.path.dirname(self.dest)):
+            os.makedirs(os.path.dirname(self.dest))
+        self._make_directory(self.dest)
+
+    def close(self):
+        # Apply directories modes from the deepest ones
+        for path in sorted(self._dirs_mode.keys(), reverse=True):
+            os.chmod(path, self._dirs_mode[path])
+        self._dirs_mode = {}
+
+    def add_directory(self, name, mode):
+        path = self._get_path(name)
+        if path == self.dest:
+            return
+        if path not in self._dirs:
+            self._make_parents(path)
+            self._make_directory(path)
+        self._dirs_mode[path] = ((mode & 0777) or 0755) | 0700
+
+    def add_file(self, name, fileobj, mode):
+        path = self._get_path(name)
+        self._make_parents(path)
+        mode = (mode & 0777) or 0644
+        flags = os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW
+        try:
+            fd = os.open(path, flags | os.O_EXCL, mode)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            # Replace the content and the mode of an existing file
+            fd = os.open(path, flags | os.O_TRUNC, mode)
+            chmod = True
+        else:
+            # Only set the bits which were masked at creation
+            chmod = bool(mode & self._umask)
+        with os.fdopen(fd, 'wb') as f:
+            if self.chown:
+                os.fchown(fd, self.uid, self.gid)
+            if chmod:
+                os.fchmod(fd, mode)
+            shutil.copyfileobj(fileobj, f, 1024 * 1024)
+
+    def add_symlink(self, name, target):
+        path = self._get_path(name)
+        self._make_parents(path)
+        if os.path.lexists(path):
+            os.remove(path)
+        self._dirs.discard(path)
+        os.symlink(target, path)
+        if self.chown:
+            os.lchown(path, self.uid, self.gid)
+
+    def add_hardlink(self, name, target):
+        path = self._get_path(name)
+        source = self._get_path(target)
+        self._make_parents(path)
+        if os.path.lexists(path):
+            os.remove(path)
+        os.link(source, path)
+
+    def _get_path(self, name):
+        path = os.path.normpath(os.path.join(self.dest, name.lstrip('/')))
+        if path != self.dest and not path.startswith(self.dest + os.sep):
+            raise ArchiveError("Member '{0}' is outside of the archive".format(
+                name))
+        # Prevent from writing through a previously extracted symbolic link
+        parent = os.path.dirname(path)
+        if parent not in self._dirs:
+            if os.path.realpath(parent) != parent:
+                raise ArchiveError(
+                    "Member '{0}' is behind a link".format(name))
+            if os.path.isdir(parent):
+                self._dirs.add(parent)
+        return path
+
+    def _make_parents(self, path):
+        parent = os.path.dirname(path)
+        if parent in self._dirs:
+            return
+        if not os.path.isdir(parent):
+            self._make_parents(parent)
+            self._make_directory(parent)
+        self._dirs.add(parent)
+
+    def _make_directory(self, path):
+        if path in self._dirs:
+            return
+        try:
+            os.mkdir(path, 0755)
+        except OSError as e:
+            # Do not follow a link to an existing directory
+            if e.errno != errno.EEXIST \
+                    or not stat.S_ISDIR(os.lstat(path).st_mode):
+                raise
+        else:
+            if self.chown:
+                os.lchown(path, self.uid, self.gid)
+        self._dirs.add(path)
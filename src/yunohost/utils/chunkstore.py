@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+""" License
+
+    Copyright (C) 2016 YUNOHOST.ORG
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program; if not, see http://www.gnu.org/licenses
+
+"""
+import os
+import json
+import stat
+import zlib
+import struct
+import hashlib
+import logging
+import tempfile
+
+logger = logging.getLogger('yunohost.utils.chunkstore')
+
+# Chunks sizes bounds, files smaller than the maximum one are stored as a
+# single chunk
+CHUNK_MIN_SIZE = 512 * 1024
+CHUNK_AVG_SIZE = 1024 * 1024
+CHUNK_MAX_SIZE = 4 * 1024 * 1024
+
+# Random values used by the rolling hash, derived from a digest to be the
+# same everywhere
+_GEAR = [struct.unpack('<I', hashlib.sha256(chr(i)).digest()[:4])[0]
+         for i in range(256)]
+
+
+# Exceptions -----------------------------------------------------------------
+
+class ChunkStoreError(Exception):
+    """The chunk store or an index is corrupted
+
+    Raised if a chunk referenced by an index is missing or does not match
+    its digest, or if an index member would be written outside of the
+    destination.
+
+    """
+
+
+# Chunk store ----------------------------------------------------------------
+
+class ChunkStore(object):
+    """Content-addressed storage of compressed chunks
+
+    Chunks are stored once in `path`, under a name made of the SHA-256
+    digest of their content, and compressed with zlib. Each index which
+    uses a chunk adds a reference to it, and a chunk is removed as soon as
+    its last reference is.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.refs_file = os.path.join(path, 'refs.json')
+        self._refs = None
+        # Digests of the chunks stored by this instance
+        self.added = set()
+
+    def chunk_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.isfile(self.chunk_path(digest))
+
+    def put(self, data):
+        """Store a chunk if it does not exist yet and return its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.isfile(path):
+            return digest
+
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname, 0700)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    raise
+
+        # Write it atomically so that a partial chunk is never used
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(zlib.compress(data, 6))
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+        self.added.add(digest)
+        return digest
+
+    def get(self, digest):
+        """Return the content of a chunk"""
+        try:
+            with open(self.chunk_path(digest), 'rb') as f:
+                data = zlib.decompress(f.read())
+        except (IOError, zlib.error) as e:
+            raise ChunkStoreError("Chunk '{0}' unavailable: {1}".format(
+                digest, e))
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ChunkStoreError("Chunk '{0}' is corrupted".format(digest))
+        return data
+
+    def add_references(self, digests):
+        """Add a reference to each of the given chunks"""
+        refs = self._get_refs()
+        for digest in digests:
+            refs[digest] = refs.get(digest, 0) + 1
+        self._store_refs()
+
+    def remove_references(self, digests):
+        """Remove a reference to each of the given chunks
+
+        Chunks which are not referenced anymore are removed, and their
+        number is returned.
+
+        """
+        refs = self._get_refs()
+        for digest in digests:
+            if digest in refs:
+                refs[digest] -= 1
+        unused = [d for d in set(digests) if refs.get(d, 0) <= 0]
+        for digest in unused:
+            refs.pop(digest, None)
+        self._store_refs()
+        return self.discard(unused)
+
+    def discard(self, digests):
+        """Remove the given chunks which are not referenced"""
+        refs = self._get_refs()
+        removed = 0
+        for digest in set(digests):
+            if refs.get(digest, 0) > 0:
+                continue
+            try:
+                os.remove(self.chunk_path(digest))
+            except OSError:
+                continue
+            removed += 1
+        return removed
+
+    def _get_refs(self):
+        if self._refs is None:
+            try:
+                with open(self.refs_file) as f:
+                    self._refs = json.load(f)
+            except IOError:
+                self._refs = {}
+        return self._refs
+
+    def _store_refs(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, 0700)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._refs, f)
+        os.rename(tmp_path, self.refs_file)
+
+
+# Chunking -------------------------------------------------------------------
+
+def iter_chunks(fileobj, size):
+    """Split the content of a file into chunks
+
+    A file of at most CHUNK_MAX_SIZE bytes is returned as a single chunk.
+    Bigger ones are split at content-defined boundaries, found with a gear
+    rolling hash, so that an insertion or a deletion only changes the chunks
+    around it.
+
+    """
+    if size <= CHUNK_MAX_SIZE:
+        yield fileobj.read()
+        return
+
+    mask = CHUNK_AVG_SIZE - 1
+    buf = ''
+    eof = False
+    while True:
+        if not eof and len(buf) < CHUNK_MAX_SIZE:
+            data = fileobj.read(CHUNK_MAX_SIZE)
+            eof = not data
+            buf += data
+        if not buf:
+            return
+        if eof and len(buf) <= CHUNK_MIN_SIZE:
+            yield buf
+            return
+        end = _find_boundary(buf, mask)
+        yield buf[:end]
+        buf = buf[end:]
+
+
+def _find_boundary(data, mask):
+    end = min(len(data), CHUNK_MAX_SIZE)
+    h = 0
+    gear = _GEAR
+    i = CHUNK_MIN_SIZE
+    for b in bytearray(data[CHUNK_MIN_SIZE:end]):
+        h = ((h << 1) + gear[b]) & 0xffffffff
+        i += 1
+        if not h & mask:
+            return i
+    return end
+
+
+# Indexes --------------------------------------------------------------------
+
+def build_index(store, sources, previous=None, progress=None):
+    """Store the content of paths into the chunk store and return its index
+
+    `sources` is a list of (path, arcname) tuples, directories being added
+    recursively. The index is a list of entries describing each member, as
+    in a tar archive, regular files listing the digests of their chunks.
+    If the index of a `previous` backup is given, files whose name, size
+    and modification time did not change reuse its chunks without being
+    read again. The optional `progress` callable is called with the size
+    and the name of each member once stored.
+
+    """
+    reusable = {}
+    for e in previous or []:
+        if e['type'] == 'file':
+            reusable[e['name']] = e
+
+    entries = []
+    inodes = {}
+    for path, arcname, s in _iter_sources(sources):
+        entry = {
+            'name': arcname,
+            'mode': stat.S_IMODE(s.st_mode),
+            'uid': s.st_uid,
+            'gid': s.st_gid,
+            'mtime': int(s.st_mtime),
+        }
+        if stat.S_ISDIR(s.st_mode):
+            entry['type'] = 'dir'
+        elif stat.S_ISLNK(s.st_mode):
+            entry['type'] = 'symlink'
+            entry['linkname'] = os.readlink(path)
+        elif stat.S_ISREG(s.st_mode):
+            key = (s.st_dev, s.st_ino)
+            if s.st_nlink > 1 and key in inodes:
+                entry['type'] = 'hardlink'
+                entry['linkname'] = inodes[key]
+                entries.append(entry)
+                continue
+            inodes[key] = arcname
+
+            entry['type'] = 'file'
+            entry['size'] = s.st_size
+            old = reusable.get(arcname)
+            if old and old['size'] == s.st_size \
+                    and old['mtime'] == entry['mtime'] \
+                    and all(store.has(d) for d in old['chunks']):
+                entry['chunks'] = old['chunks']
+            else:
+                entry['chunks'] = []
+                with open(path, 'rb') as f:
+                    for data in iter_chunks(f, s.st_size):
+                        entry['chunks'].append(store.put(data))
+        else:
+            logger.debug("skipping special file '%s'", path)
+            continue
+        entries.append(entry)
+        if progress:
+            progress(entry.get('size', 0), arcname)
+    return entries
+
+
+def get_index_chunks(entries):
+    """Return the digests of the chunks used by an index"""
+    return [d for e in entries if e['type'] == 'file' for d in e['chunks']]
+
+
+def extract_index(store, entries, dest):
+    """Restore the members of an index into dest
+
+    Owners, modes and modification times are restored, directories ones
+    being applied once their content is written.
+
+    """
+    dest = os.path.realpath(dest)
+    if not os.path.isdir(dest):
+        os.makedirs(dest, 0750)
+
+    dirs = []
+    for e in entries:
+        path = os.path.normpath(os.path.join(dest, e['name']))
+        if path != dest and not path.startswith(dest + os.sep):
+            raise ChunkStoreError(
+                "Member '{0}' is outside of the destination".format(e['name']))
+        # Prevent from writing through a previously extracted symbolic link,
+        # the links of the existing ancestors being resolved by realpath
+        # before any missing one is created
+        parent = os.path.dirname(path)
+        if parent != dest and os.path.realpath(parent) != parent:
+            raise ChunkStoreError(
+                "Member '{0}' is behind a link".format(e['name']))
+        if not os.path.isdir(parent):
+            os.makedirs(parent, 0750)
+
+        if e['type'] == 'dir':
+            if not os.path.isdir(path):
+                os.mkdir(path, 0700)
+            dirs.append((path, e))
+            continue
+
+        if os.path.lexists(path):
+            os.remove(path)
+        if e['type'] == 'symlink':
+            os.symlink(e['linkname'], path)
+            os.lchown(path, e['uid'], e['gid'])
+            continue
+        elif e['type'] == 'hardlink':
+            os.link(os.path.join(dest, e['linkname']), path)
+            continue
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+        with os.fdopen(fd, 'wb') as f:
+            for digest in e['chunks']:
+                f.write(store.get(digest))
+        _set_attributes(path, e)
+
+    # Apply directories attributes from the deepest ones
+    for path, e in reversed(dirs):
+        _set_attributes(path, e)
+
+
+def _iter_sources(sources):
+    for path, arcname in sources:
+        s = os.lstat(path)
+        yield path, arcname, s
+        if not stat.S_ISDIR(s.st_mode):
+            continue
+        for root, dirs, files in os.walk(path):
+            for name in sorted(dirs) + sorted(files):
+                p = os.path.join(root, name)
+                yield p, os.path.normpath(os.path.join(
+                    arcname, os.path.relpath(p, path))), os.lstat(p)
+            dirs.sort()
+
+
+def _set_attributes(path, entry):
+    os.chown(path, entry['uid'], entry['gid'])
+    os.chmod(path, entry['mode'])
+    os.utime(path, (entry['mtime'], entry['mtime']))
@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+
+""" License
+
+    Copyright (C) 2016 YUNOHOST.ORG
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program; if not, see http://www.gnu.org/licenses
+
+"""
+import bz2
+import zlib
+import time
+import bisect
+import logging
+import multiprocessing
+from collections import deque, OrderedDict
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+logger = logging.getLogger('yunohost.utils.compression')
+
+
+# Exceptions -----------------------------------------------------------------
+
+class CodecError(ValueError):
+    """The codec is unknown or cannot be used
+
+    Raised if the codec does not exist, if the module it needs is not
+    installed or if the compression level is out of its range.
+
+    """
+
+
+def _compress_gzip_member(data, compresslevel):
+    """Compress data as a standalone gzip member"""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ParallelGzipFile(object):
+    """Write-only gzip file compressing blocks concurrently
+
+    Written data is split into blocks of `block_size` bytes which are each
+    compressed as an independent gzip member by a pool of `jobs` threads -
+    zlib releasing the GIL while compressing - and written in order. The
+    result is a standard multi-member gzip file, which can be read by gzip,
+    tar or the gzip and tarfile modules. At most twice as many blocks as
+    threads are kept in memory.
+
+    The number of threads defaults to the number of CPUs. It can be used
+    as the `fileobj` of a tarfile opened in 'w' or 'w|' mode.
+
+    The uncompressed and compressed offsets of each written member are kept
+    in `blocks`, so that the file can later be read from any offset with a
+    GzipBlockReader.
+
+    """
+    block_size = 1024 * 1024
+
+    def __init__(self, filename=None, mode='wb', fileobj=None,
+                 compresslevel=6, jobs=None, block_size=None):
+        if mode not in ('w', 'wb'):
+            raise ValueError("invalid mode: '{0}'".format(mode))
+
+        if fileobj is None:
+            fileobj = open(filename, 'wb')
+            self._extfileobj = False
+        else:
+            self._extfileobj = True
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        if block_size:
+            self.block_size = block_size
+
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self._pool = ThreadPool(self.jobs)
+        self._pending = deque()
+        self._buffer = []
+        self._buffer_size = 0
+        self._offset = 0
+        self._compressed_offset = 0
+        self._pending_offset = 0
+        self.blocks = []
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def tell(self):
+        """Return the uncompressed position"""
+        return self._offset
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write() on closed ParallelGzipFile object")
+
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        self._offset += len(data)
+
+        if self._buffer_size >= self.block_size:
+            data = ''.join(self._buffer)
+            for i in range(0, len(data) - self.block_size + 1,
+                           self.block_size):
+                self._compress(data[i:i+self.block_size])
+            rest = data[len(data) - len(data) % self.block_size:]
+            self._buffer = [rest] if rest else []
+            self._buffer_size = len(rest)
+
+    def flush(self):
+        """Compress and write all the buffered data"""
+        if self._buffer:
+            self._compress(''.join(self._buffer))
+            self._buffer, self._buffer_size = [], 0
+        while self._pending:
+            self._write_block()
+        self.fileobj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # Always write at least one member to produce a valid file
+            if not self._offset:
+                self._compress('')
+            self.flush()
+        finally:
+            self.closed = True
+            self._pool.terminate()
+            self._pool.join()
+            if not self._extfileobj:
+                self.fileobj.close()
+
+    def _compress(self, data):
+        self._pending.append((self._pending_offset, self._pool.apply_async(
+            _compress_gzip_member, [data, self.compresslevel])))
+        self._pending_offset += len(data)
+
+        # Write compressed blocks in order, waiting for the oldest one if
+        # too many are pending
+        while self._pending and (self._pending[0][1].ready()
+                                 or len(self._pending) > 2 * self.jobs):
+            self._write_block()
+
+    def _write_block(self):
+        offset, result = self._pending.popleft()
+        data = result.get()
+        self.blocks.append((offset, self._compressed_offset))
+        self.fileobj.write(data)
+        self._compressed_offset += len(data)
+
+
+class GzipBlockReader(object):
+    """Read-only file reading a multi-member gzip file from an offset
+
+    `blocks` is the list of the uncompressed and compressed offsets of each
+    member of the file, as given by ParallelGzipFile. Reading starts at the
+    uncompressed `offset`, only the members from the one containing it
+    being read and decompressed.
+
+    """
+
+    def __init__(self, fileobj, blocks, offset=0):
+        self.fileobj = fileobj
+        self.blocks = blocks
+        self._index = max(bisect.bisect_right(
+            [b[0] for b in blocks], offset) - 1, 0)
+        self._skip = offset - blocks[self._index][0] if blocks else 0
+        self._buffer = ''
+        self._pos = 0
+
+    def read(self, size=-1):
+        while (size < 0 or len(self._buffer) - self._pos < size) \
+                and self._index < len(self.blocks):
+            self._read_block()
+        if size < 0:
+            size = len(self._buffer) - self._pos
+        data = self._buffer[self._pos:self._pos+size]
+        self._pos += len(data)
+        return data
+
+    def _read_block(self):
+        start = self.blocks[self._index][1]
+        self._index += 1
+        self.fileobj.seek(start)
+        if self._index < len(self.blocks):
+            data = self.fileobj.read(self.blocks[self._index][1] - start)
+        else:
+            data = self.fileobj.read()
+
+        data = zlib.decompress(data, 31)
+        if self._skip:
+            data, self._skip = data[self._skip:], max(self._skip - len(data), 0)
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+
+
+# Codecs ---------------------------------------------------------------------
+
+class _Codec(object):
+    """Compression codec of backup archives"""
+
+    def __init__(self, name, extension, levels=None, default_level=None,
+                 benchmark_levels=(), compressor=None, decompressor=None,
+                 available=True):
+        self.name = name
+        self.extension = extension
+        self.levels = levels
+        self.default_level = default_level
+        self.benchmark_levels = benchmark_levels or (default_level,)
+        self.compressor = compressor
+        self.decompressor = decompressor
+        self.available = available
+
+    def check_level(self, level):
+        """Return the level to use, raising CodecError if it is invalid"""
+        if level is None or self.levels is None:
+            return self.default_level
+        if not self.levels[0] <= level <= self.levels[1]:
+            raise CodecError("Level of '{0}' must be between {1} and {2}"
+                             .format(self.name, *self.levels))
+        return level
+
+
+CODECS = OrderedDict((c.name, c) for c in [
+    _Codec('none', '.tar'),
+    _Codec('gzip', '.tar.gz', (1, 9), 6, (1, 6, 9),
+           decompressor=lambda: zlib.decompressobj(31)),
+    _Codec('bz2', '.tar.bz2', (1, 9), 9, (1, 9),
+           compressor=lambda level: bz2.BZ2Compressor(level),
+           decompressor=bz2.BZ2Decompressor),
+    _Codec('xz', '.tar.xz', (0, 9), 6, (0, 6),
+           compressor=lambda level: lzma.LZMACompressor(preset=level),
+           decompressor=lambda: lzma.LZMADecompressor(),
+           available=lzma is not None),
+    _Codec('zstd', '.tar.zst', (1, 22), 3, (1, 3, 19),
+           compressor=lambda level: zstd.ZstdCompressor(
+               level=level).compressobj(),
+           decompressor=lambda: zstd.ZstdDecompressor().decompressobj(),
+           available=zstd is not None),
+])
+
+
+def get_codec(name):
+    """Return an available codec by its name, or raise CodecError"""
+    codec = CODECS.get(name)
+    if codec is None or not codec.available:
+        raise CodecError("Codec '{0}' is unknown or unavailable".format(name))
+    return codec
+
+
+def get_codec_from_filename(filename):
+    """Return the name of the codec of an archive from its extension"""
+    for codec in sorted(CODECS.values(), key=lambda c: -len(c.extension)):
+        if filename.endswith(codec.extension):
+            return codec.name
+    return None
+
+
+def open_compressed_writer(filename=None, codec='gzip', level=None,
+                           jobs=None, fileobj=None):
+    """Open a file to write data compressed with a codec
+
+    Gzip data is compressed with a ParallelGzipFile of `jobs` threads. The
+    given `fileobj` is not closed with the returned file.
+
+    """
+    c = get_codec(codec)
+    level = c.check_level(level)
+    if c.name == 'gzip':
+        return ParallelGzipFile(filename, fileobj=fileobj,
+                                compresslevel=level, jobs=jobs)
+    return _CompressedFile(filename, fileobj,
+                           c.compressor(level) if c.compressor else None)
+
+
+def open_compressed_reader(filename=None, codec='gzip', fileobj=None):
+    """Open a file to read data compressed with a codec
+
+    The returned file can only be read sequentially, e.g. by a tarfile
+    opened in 'r|' mode. The given `fileobj` is not closed with it.
+
+    """
+    c = get_codec(codec)
+    return _DecompressedFile(filename, fileobj, c.decompressor)
+
+
+def benchmark_codec(data, codec, level=None, jobs=None):
+    """Compress and decompress data with a codec and return the results
+
+    A dict with the compressed size, the compression `ratio` and the
+    compression and decompression speeds in bytes per second is returned.
+
+    """
+    start = time.time()
+    compressed = StringIO()
+    f = open_compressed_writer(codec=codec, level=level, jobs=jobs,
+                               fileobj=compressed)
+    f.write(data)
+    f.close()
+    compress_time = time.time() - start
+
+    start = time.time()
+    f = open_compressed_reader(codec=codec,
+                               fileobj=StringIO(compressed.getvalue()))
+    while f.read(1024 * 1024):
+        pass
+    f.close()
+    decompress_time = time.time() - start
+
+    size = len(compressed.getvalue())
+    return {
+        'size': size,
+        'ratio': float(len(data)) / max(size, 1),
+        'compress_speed': len(data) / max(compress_time, 1e-6),
+        'decompress_speed': len(data) / max(decompress_time, 1e-6),
+    }
+
+
+class _CompressedFile(object):
+    """Write-only file compressing data with a compressor object"""
+
+    def __init__(self, filename=None, fileobj=None, compressor=None):
+        if fileobj is None:
+            fileobj = open(filename, 'wb')
+            self._extfileobj = False
+        else:
+            self._extfileobj = True
+        self.fileobj = fileobj
+        self.compressor = compressor
+        self._offset = 0
+        self.closed = False
+
+    def tell(self):
+        """Return the uncompressed position"""
+        return self._offset
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write() on closed file")
+        self._offset += len(data)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        if data:
+            self.fileobj.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.compressor is not None:
+                self.fileobj.write(self.compressor.flush())
+            self.fileobj.flush()
+        finally:
+            self.closed = True
+            if not self._extfileobj:
+                self.fileobj.close()
+
+
+class _DecompressedFile(object):
+    """Read-only file decompressing data with decompressor objects
+
+    Concatenated streams - such as the members of a gzip file - are read
+    by using a new decompressor object for each one.
+
+    """
+    read_size = 64 * 1024
+
+    def __init__(self, filename=None, fileobj=None, decompressor=None):
+        if fileobj is None:
+            fileobj = open(filename, 'rb')
+            self._extfileobj = False
+        else:
+            self._extfileobj = True
+        self.fileobj = fileobj
+        self._new_decompressor = decompressor
+        self._decompressor = decompressor() if decompressor else None
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0
+                                 or len(self._buffer) - self._pos < size):
+            self._fill()
+        if size < 0:
+            size = len(self._buffer) - self._pos
+        data = self._buffer[self._pos:self._pos+size]
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        if not self._extfileobj:
+            self.fileobj.close()
+
+    def _fill(self):
+        data = self.fileobj.read(self.read_size)
+        if not data:
+            self._eof = True
+            return
+        if self._decompressor is not None:
+            out = []
+            while data:
+                out.append(self._decompressor.decompress(data))
+                # Start a new stream with the remaining data, if any
+                data = getattr(self._decompressor, 'unused_data', '')
+                if data:
+                    self._decompressor = self._new_decompressor()
+            data = ''.join(out)
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+""" License
+
+    Copyright (C) 2016 YUNOHOST.ORG
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program; if not, see http://www.gnu.org/licenses
+
+"""
+import os
+import pwd
+import grp
+import stat
+import logging
+from fnmatch import fnmatch
+
+logger = logging.getLogger('yunohost.utils.permissions')
+
+
+def apply_permissions(root, rules):
+    """Set the owner and mode of a tree in a single walk
+
+    Each rule of `rules` is a tuple of a glob `pattern` - matched against
+    paths relative to `root`, which is itself matched as '.', and where
+    '*' also matches '/' - with an `owner` and a `mode`. The last matching
+    rule of each of both takes precedence, a None value leaving it as is.
+
+    The owner is given as 'user', meaning its login group, or as
+    'user:group'. The mode is given as an int, as a (dirmode, filemode)
+    tuple or as a callable which returns the new mode from the current one
+    and whether the path is a directory. Symbolic links are never followed
+    and only their owner is set. Paths already having the expected owner
+    and mode are left untouched.
+
+    """
+    rules = [(pattern, _get_owner_ids(owner), mode)
+             for pattern, owner, mode in rules]
+
+    _apply_rules(root, '.', rules)
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            _apply_rules(path, os.path.relpath(path, root), rules)
+
+
+def _apply_rules(path, relpath, rules):
+    owner = mode = None
+    for pattern, rule_owner, rule_mode in rules:
+        if fnmatch(relpath, pattern):
+            if rule_owner is not None:
+                owner = rule_owner
+            if rule_mode is not None:
+                mode = rule_mode
+    if owner is None and mode is None:
+        return
+
+    s = os.lstat(path)
+    if owner is not None and owner != (s.st_uid, s.st_gid):
+        os.lchown(path, *owner)
+    if mode is None or stat.S_ISLNK(s.st_mode):
+        return
+
+    is_dir = stat.S_ISDIR(s.st_mode)
+    current = stat.S_IMODE(s.st_mode)
+    if callable(mode):
+        mode = mode(current, is_dir)
+    elif isinstance(mode, tuple):
+        mode = mode[0] if is_dir else mode[1]
+    if mode != current:
+        os.chmod(path, mode)
+
+
+def _get_owner_ids(owner):
+    """Return the (uid, gid) tuple of a 'user[:group]' owner"""
+    if owner is None:
+        return None
+    user, _, group = owner.partition(':')
+    pw = pwd.getpwnam(user)
+    gid = grp.getgrnam(group).gr_gid if group else pw.pw_gid
+    return (pw.pw_uid, gid)